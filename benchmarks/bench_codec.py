@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Microbenchmarks of the batch example codec against `procedure_to_example` and
+`example_to_procedure`, in both directions.
+"""
+import logging
+import random
+import sys
+import timeit
+
+import click
+
+from proc_gen import Problem
+from proc_gen.data import procedure_to_example, example_to_procedure
+from proc_gen.data.codec import (
+    _parse_requirement,
+    examples_to_procedures,
+    procedures_to_examples,
+)
+from proc_gen.data.schema import Procedure, Method, Requirement
+
+logger = logging.getLogger("bench_codec")
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.setLevel(logging.INFO)
+
+WORDS = "salt pepper sugar flour butter onion garlic oil water milk egg cheese".split()
+QUANTITIES = ["", "1 cup", "2 tablespoons", "1/2 teaspoon", "3"]
+
+
+def random_procedures(num: int, seed: int = 0):
+    rng = random.Random(seed)
+
+    def words(n):
+        return " ".join(rng.choice(WORDS) for _ in range(n))
+
+    return [
+        Procedure(
+            target_product=words(rng.randint(1, 5)),
+            methods=[
+                Method(
+                    requirements=[
+                        Requirement(
+                            object=words(rng.randint(1, 3)),
+                            quantity=rng.choice(QUANTITIES),
+                            optional=rng.random() < 0.1,
+                        )
+                        for _ in range(rng.randint(3, 15))
+                    ],
+                    tasks=[
+                        words(rng.randint(5, 25)) for _ in range(rng.randint(3, 15))
+                    ],
+                )
+            ],
+        )
+        for _ in range(num)
+    ]
+
+
+def best_time(fn, repeat: int, setup=lambda: None) -> float:
+    return min(timeit.repeat(fn, setup=setup, number=1, repeat=repeat))
+
+
+@click.command()
+@click.option("--num-procedures", type=int, default=10000)
+@click.option("--repeat", type=int, default=5)
+@click.option(
+    "--problem",
+    type=click.Choice(Problem.__members__.keys()),
+    default=Problem.Requirements_TO_TargetProductAndTasks.name,
+    help="Problem to benchmark. Decoding is only compared for problems "
+    "`example_to_procedure` parses correctly.",
+)
+def bench_codec(num_procedures, repeat, problem):
+    problem = Problem[problem]
+    procs = random_procedures(num_procedures)
+    examples = [procedure_to_example(proc, problem) for proc in procs]
+
+    results = {
+        "encode/procedure_to_example": best_time(
+            lambda: [procedure_to_example(proc, problem) for proc in procs], repeat
+        ),
+        "encode/procedures_to_examples": best_time(
+            lambda: procedures_to_examples(procs, problem), repeat
+        ),
+        # With the requirement cache cleared, like a single pass over the data
+        "decode/examples_to_procedures": best_time(
+            lambda: examples_to_procedures(examples, problem),
+            repeat,
+            setup=_parse_requirement.cache_clear,
+        ),
+    }
+    # example_to_procedure asserts that every field is present, and reads
+    # TargetProductAndRequirements_TO_Tasks examples with the target product first
+    if problem is Problem.Requirements_TO_TargetProductAndTasks:
+        results["decode/example_to_procedure"] = best_time(
+            lambda: [example_to_procedure(example, problem) for example in examples],
+            repeat,
+        )
+
+    for name, seconds in sorted(results.items()):
+        logger.info(
+            f"{name:<32} {seconds * 1000:9.1f} ms "
+            f"{num_procedures / seconds:12.0f} examples/s"
+        )
+
+
+if __name__ == "__main__":
+    bench_codec()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+A small GPT-2 style BPE (encoder.json and vocab.bpe), learned from a corpus, so the
+BPE encoder can be benchmarked without downloading the GPT-2 vocabulary.
+"""
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+
+def learn_merges(words: Counter, num_merges: int) -> List[Tuple[str, str]]:
+    """Learns BPE merges from word frequencies (words as tuples of symbols)."""
+    words = dict(words)
+    merges = []
+    for _ in range(num_merges):
+        pairs = Counter()
+        for word, count in words.items():
+            for pair in zip(word, word[1:]):
+                pairs[pair] += count
+        if not pairs:
+            break
+        best = max(pairs, key=pairs.get)
+        merges.append(best)
+
+        merged = {}
+        for word, count in words.items():
+            symbols, i = [], 0
+            while i < len(word):
+                if word[i : i + 2] == best:
+                    symbols.append(word[i] + word[i + 1])
+                    i += 2
+                else:
+                    symbols.append(word[i])
+                    i += 1
+            merged[tuple(symbols)] = merged.get(tuple(symbols), 0) + count
+        words = merged
+
+    return merges
+
+
+def write_bpe_fixture(lines: Iterable[str], out_dir: Path, num_merges: int = 500):
+    """
+    Writes encoder.json and vocab.bpe to `out_dir`.
+
+    :return: (Path, Path) paths of encoder.json and vocab.bpe
+    """
+    from fairseq.data.encoders.gpt2_bpe_utils import bytes_to_unicode
+
+    byte_encoder = bytes_to_unicode()
+
+    def to_symbols(word: str) -> tuple:
+        # GPT-2 pre-tokenization keeps the preceding space with each word
+        return tuple(byte_encoder[b] for b in (" " + word).encode("utf-8"))
+
+    words = Counter()
+    for line in lines:
+        words.update(to_symbols(word) for word in line.split())
+    merges = learn_merges(words, num_merges)
+
+    # Every byte is a symbol, so any text can be encoded
+    vocab = list(byte_encoder.values()) + [a + b for a, b in merges]
+    encoder = {symbol: i for i, symbol in enumerate(dict.fromkeys(vocab))}
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    encoder_json, vocab_bpe = out_dir / "encoder.json", out_dir / "vocab.bpe"
+    with open(encoder_json, "w", encoding="utf-8") as f:
+        json.dump(encoder, f, ensure_ascii=False)
+    with open(vocab_bpe, "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+        f.writelines(f"{a} {b}\n" for a, b in merges)
+
+    return encoder_json, vocab_bpe
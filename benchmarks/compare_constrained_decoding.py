@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Compares requirement-constrained beam search with small beams against unconstrained
+beam search on a test set: generation throughput, and requirement coverage of the
+generated tasks (req_cov and essential_req_cov).
+"""
+import copy
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import click
+
+from proc_gen import Problem
+from proc_gen.configs import ARCH_PARAM_TO_STRING
+from proc_gen.evaluate import get_scores
+from proc_gen.utils import get_ckpt_dir
+
+logger = logging.getLogger("compare_constrained_decoding")
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.propagate = False
+logger.setLevel(logging.INFO)
+
+METRICS = ["req_cov", "essential_req_cov"]
+
+
+def load_model_and_task(data_bin: Path, ckpt_path: Path, batch_size: int, cpu: bool):
+    import torch
+    from fairseq import checkpoint_utils, options, tasks
+
+    import proc_gen.fairseq_ext
+
+    parser = options.get_generation_parser()
+    args = options.parse_args_and_arch(
+        parser,
+        input_args=[
+            str(data_bin),
+            "--user-dir",
+            str(Path(proc_gen.fairseq_ext.__file__).parent),
+            "--task",
+            "requirement_constrained_translation",
+            "--path",
+            str(ckpt_path),
+            "--batch-size",
+            str(batch_size),
+        ],
+    )
+    args.cpu = cpu or not torch.cuda.is_available()
+    task = tasks.setup_task(args)
+    models, _ = checkpoint_utils.load_model_ensemble([str(ckpt_path)], task=task)
+    for model in models:
+        model.prepare_for_inference_(args)
+        if not args.cpu:
+            model.cuda()
+    task.load_dataset(args.gen_subset)
+    return args, task, models
+
+
+def generate(args, task, models, beam: int, constrained: bool) -> Tuple[Dict, float]:
+    """
+    :return: (dict) hypothesis per sample id, (float) seconds spent in search
+    """
+    from fairseq import utils
+
+    args = copy.copy(args)
+    args.beam = beam
+    args.constraints = "unordered" if constrained else None
+    generator = task.build_generator(models, args)
+    batches = task.get_batch_iterator(
+        dataset=task.dataset(args.gen_subset),
+        max_tokens=args.max_tokens,
+        max_sentences=args.batch_size,
+        max_positions=utils.resolve_max_positions(
+            task.max_positions(), *[m.max_positions() for m in models]
+        ),
+        ignore_invalid_inputs=True,
+        num_workers=args.num_workers,
+    ).next_epoch_itr(shuffle=False)
+
+    hypotheses, seconds = {}, 0.0
+    for sample in batches:
+        if not args.cpu:
+            sample = utils.move_to_cuda(sample)
+        start = time.perf_counter()
+        hypos = task.inference_step(generator, models, sample)
+        seconds += time.perf_counter() - start
+        for i, sample_id in enumerate(sample["id"].tolist()):
+            hypotheses[sample_id] = task.target_dictionary.string(hypos[i][0]["tokens"])
+    return hypotheses, seconds
+
+
+def test_data(task, split: str) -> Tuple[List[str], List[str]]:
+    """:return: (List[str]) sources and (List[str]) references, by sample id"""
+    dataset = task.dataset(split)
+    sources, references = [], []
+    for i in range(len(dataset)):
+        sources.append(task.source_dictionary.string(dataset.src[i]))
+        references.append(task.target_dictionary.string(dataset.tgt[i]))
+    return sources, references
+
+
+@click.command()
+@click.option(
+    "--data_dir",
+    default="/data/procgen/v1/processed",
+    help="Base dir of the processed train/val/test files.",
+)
+@click.option(
+    "--dataset",
+    type=click.Choice(["Recipe1M", "dummy", "synthetic"]),
+    help="Which dataset the model was trained on.",
+)
+@click.option(
+    "--problem",
+    type=click.Choice(
+        [
+            Problem.Requirements_TO_TargetProductAndTasks.name,
+            Problem.TargetProductAndRequirements_TO_Tasks.name,
+        ]
+    ),
+    default=Problem.Requirements_TO_TargetProductAndTasks.name,
+)
+@click.option(
+    "--model_arch",
+    type=click.Choice(["lstm", "conv", "transformer", "bart"]),
+    help="Which model architecture to use.",
+)
+@click.option("--version", type=int, default=0, help="Which model version.")
+@click.option("--checkpoint", default="checkpoint_best.pt", help="Checkpoint file.")
+@click.option(
+    "--beam",
+    "beams",
+    type=int,
+    multiple=True,
+    default=[2, 4],
+    help="Beam sizes of constrained beam search.",
+)
+@click.option(
+    "--baseline_beam",
+    type=int,
+    default=10,
+    help="Beam size of the unconstrained baseline.",
+)
+@click.option("--batch_size", type=int, default=32, help="Sentences per batch.")
+@click.option(
+    "--cpu", is_flag=True, help="Generate on CPU, even if a GPU is available."
+)
+@click.option(
+    "--output", default="constrained_decoding_comparison.json", help="Results file."
+)
+def compare_constrained_decoding(
+    data_dir,
+    dataset,
+    problem,
+    model_arch,
+    version,
+    checkpoint,
+    beams,
+    baseline_beam,
+    batch_size,
+    cpu,
+    output,
+):
+    data_dir = Path(data_dir) / problem / dataset / "fairseq"
+    ckpt_path = (
+        get_ckpt_dir(data_dir, ARCH_PARAM_TO_STRING[model_arch], version) / checkpoint
+    )
+    args, task, models = load_model_and_task(
+        data_dir / "data-bin/tokenized", ckpt_path, batch_size, cpu
+    )
+    sources, references = test_data(task, args.gen_subset)
+    logger.info(f"Generating {len(sources)} test examples with {ckpt_path}")
+
+    configs = [(f"beam{baseline_beam}", baseline_beam, False)] + [
+        (f"constrained-beam{beam}", beam, True) for beam in beams
+    ]
+    model_to_hypotheses, results = {}, {}
+    for name, beam, constrained in configs:
+        hypotheses, seconds = generate(args, task, models, beam, constrained)
+        model_to_hypotheses[name] = [hypotheses.get(i, "") for i in range(len(sources))]
+        results[name] = {
+            "beam": beam,
+            "constrained": constrained,
+            "seconds": seconds,
+            "sentences_per_sec": len(hypotheses) / seconds,
+        }
+
+    corpus_scores, _ = get_scores(
+        {"0": sources},
+        {"0": references},
+        model_to_hypotheses,
+        metrics=METRICS,
+        problem=problem,
+    )
+    baseline = configs[0][0]
+    logger.info(
+        f"{'decoding':<22}{'sentences/s':>12}{'speedup':>9}"
+        + "".join(f"{metric:>19}" for metric in METRICS)
+    )
+    for name, _, _ in configs:
+        result = results[name]
+        result["speedup"] = results[baseline]["seconds"] / result["seconds"]
+        for metric in METRICS:
+            result[metric] = float(corpus_scores[metric][name])
+        logger.info(
+            f"{name:<22}{result['sentences_per_sec']:>12.2f}{result['speedup']:>8.2f}x"
+            + "".join(f"{result[metric]:>19.2f}" for metric in METRICS)
+        )
+
+    with open(output, "w") as f:
+        json.dump(
+            {"checkpoint": str(ckpt_path), "samples": len(sources), "results": results},
+            f,
+            indent=2,
+        )
+    logger.info(f"Wrote results to {output}")
+
+
+if __name__ == "__main__":
+    compare_constrained_decoding()
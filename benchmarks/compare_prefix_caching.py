@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Compares generating several continuations per prompt with a gpt2 language model
+through fairseq's SequenceGenerator, which feeds the prompt as prefix tokens one
+decoder step at a time for every sample, against PrefixCachedGenerator, which
+encodes the prompt once and forks its incremental state across the samples.
+
+Also checks that greedy search gives the same continuations with both.
+"""
+import json
+import logging
+import sys
+import time
+from argparse import Namespace
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import click
+import torch
+
+from proc_gen import TASK_TO_PROBLEMS
+from proc_gen.configs import ARCH_PARAM_TO_STRING
+from proc_gen.utils import get_ckpt_dir
+
+logger = logging.getLogger("compare_prefix_caching")
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.propagate = False
+logger.setLevel(logging.INFO)
+
+
+def load_model_and_task(data_bin: Path, ckpt_path: Path, cpu: bool):
+    from fairseq import checkpoint_utils
+
+    # Registers the procedure_shuffle task
+    import proc_gen.fairseq_ext
+
+    models, _, task = checkpoint_utils.load_model_ensemble_and_task(
+        [str(ckpt_path)], arg_overrides={"data": str(data_bin)}
+    )
+    model = models[0].eval()
+    if not cpu:
+        model.cuda()
+    return model, task
+
+
+def sequence_generator_fn(
+    task, model, num_samples: int, max_len: int, sampling: bool, sampling_topk: int
+) -> Callable[[torch.Tensor], List[torch.Tensor]]:
+    """:return: function from a prompt to its continuations, through fairseq"""
+    generator = task.build_generator(
+        [model],
+        Namespace(
+            beam=num_samples,
+            nbest=num_samples,
+            sampling=sampling,
+            sampling_topk=sampling_topk,
+            max_len_a=0,
+            max_len_b=max_len,
+        ),
+    )
+    device = next(model.parameters()).device
+
+    def generate(prompt: torch.Tensor) -> List[torch.Tensor]:
+        # The prefix tokens count towards the max length
+        generator.max_len_b = len(prompt) + max_len
+        prompt = prompt.to(device).unsqueeze(0)
+        sample = {
+            "net_input": {
+                "src_tokens": prompt,
+                "src_lengths": torch.tensor([prompt.size(1)]),
+            }
+        }
+        hypos = task.inference_step(generator, [model], sample)[0]
+        return [hypo["tokens"][prompt.size(1) :].cpu() for hypo in hypos]
+
+    return generate
+
+
+def prefix_cached_fn(
+    task, model, num_samples: int, max_len: int, sampling: bool, sampling_topk: int
+) -> Callable[[torch.Tensor], List[torch.Tensor]]:
+    """:return: function from a prompt to its continuations, with prompt caching"""
+    from proc_gen.fairseq_ext.prefix_cache import PrefixCachedGenerator
+
+    generator = PrefixCachedGenerator(
+        model,
+        task.target_dictionary,
+        max_len=max_len,
+        sampling_topk=sampling_topk,
+        # Don't reuse the prompts of an earlier run
+        cache_size=0,
+    )
+    device = next(model.parameters()).device
+
+    def generate(prompt: torch.Tensor) -> List[torch.Tensor]:
+        prompt = prompt.to(device)
+        if sampling:
+            hypos = generator.sample(prompt, num_samples)
+        else:
+            hypos = generator.beam_search(prompt, num_samples, nbest=num_samples)
+        return [hypo["tokens"].cpu() for hypo in hypos]
+
+    return generate
+
+
+def run(
+    generate: Callable, prompts: List[torch.Tensor], cuda: bool
+) -> Tuple[List[List[torch.Tensor]], float]:
+    """:return: continuations per prompt, (float) seconds spent generating"""
+    continuations = []
+    start = time.perf_counter()
+    for prompt in prompts:
+        continuations.append(generate(prompt))
+    if cuda:
+        torch.cuda.synchronize()
+    return continuations, time.perf_counter() - start
+
+
+@click.command()
+@click.option(
+    "--data_dir",
+    default="/data/procgen/v1/processed",
+    help="Base dir of the processed train/val/test files.",
+)
+@click.option(
+    "--dataset",
+    type=click.Choice(["Recipe1M", "dummy", "synthetic"]),
+    help="Which dataset the model was trained on.",
+)
+@click.option(
+    "--problem",
+    type=click.Choice([p.name for p in TASK_TO_PROBLEMS["language_modeling"]]),
+    default="RequirementsAndTargetProductAndTasks",
+)
+@click.option("--version", type=int, default=0, help="Which model version.")
+@click.option("--checkpoint", default="checkpoint_best.pt", help="Checkpoint file.")
+@click.option(
+    "--num_samples",
+    type=int,
+    multiple=True,
+    default=[1, 4, 16],
+    help="Continuations per prompt.",
+)
+@click.option(
+    "--max_prompts", type=int, default=50, help="Number of test prompts to generate."
+)
+@click.option("--max_len", type=int, default=200, help="Max continuation length.")
+@click.option(
+    "--sampling_topk",
+    type=int,
+    default=-1,
+    help="Sample from the k most likely tokens only.",
+)
+@click.option(
+    "--cpu", is_flag=True, help="Generate on CPU, even if a GPU is available."
+)
+@click.option(
+    "--output", default="prefix_caching_comparison.json", help="Results file."
+)
+def compare_prefix_caching(
+    data_dir,
+    dataset,
+    problem,
+    version,
+    checkpoint,
+    num_samples,
+    max_prompts,
+    max_len,
+    sampling_topk,
+    cpu,
+    output,
+):
+    from proc_gen.fairseq_ext.prefix_cache import load_prompts
+
+    cpu = cpu or not torch.cuda.is_available()
+    data_dir = Path(data_dir) / problem / dataset / "fairseq"
+    ckpt_dir = get_ckpt_dir(data_dir, ARCH_PARAM_TO_STRING["gpt2"], version)
+    ckpt_path = ckpt_dir / checkpoint
+    model, task = load_model_and_task(data_dir / "data-bin/tokenized", ckpt_path, cpu)
+    prompts = [prompt for _, prompt in load_prompts(task, "test")][:max_prompts]
+    logger.info(
+        f"Generating {len(prompts)} test prompts (mean length "
+        f"{sum(map(len, prompts)) / len(prompts):.1f}) with {ckpt_path}"
+    )
+
+    results = {}
+    with torch.no_grad():
+        # Greedy search is deterministic, so both should give the same continuations
+        greedy = {}
+        for name, generate_fn in [
+            ("sequence_generator", sequence_generator_fn),
+            ("prefix_cached", prefix_cached_fn),
+        ]:
+            generate = generate_fn(task, model, 1, max_len, False, -1)
+            greedy[name], _ = run(generate, prompts, not cpu)
+        identical = sum(
+            torch.equal(baseline[0], cached[0])
+            for baseline, cached in zip(
+                greedy["sequence_generator"], greedy["prefix_cached"]
+            )
+        )
+        results["greedy_identical"] = identical / len(prompts)
+        logger.info(f"Identical greedy continuations: {identical}/{len(prompts)}")
+
+        logger.info(
+            f"{'samples':>8}{'generator':>20}{'samples/s':>11}{'tokens/s':>10}"
+            f"{'speedup':>9}"
+        )
+        for n in num_samples:
+            seconds = {}
+            for name, generate_fn in [
+                ("sequence_generator", sequence_generator_fn),
+                ("prefix_cached", prefix_cached_fn),
+            ]:
+                torch.manual_seed(1)
+                generate = generate_fn(task, model, n, max_len, True, sampling_topk)
+                continuations, seconds[name] = run(generate, prompts, not cpu)
+                num_tokens = sum(len(c) for cs in continuations for c in cs)
+                results[f"{name}-{n}"] = {
+                    "num_samples": n,
+                    "seconds": seconds[name],
+                    "samples_per_sec": len(prompts) * n / seconds[name],
+                    "tokens_per_sec": num_tokens / seconds[name],
+                    "speedup": seconds["sequence_generator"] / seconds[name],
+                }
+                result = results[f"{name}-{n}"]
+                logger.info(
+                    f"{n:>8}{name:>20}{result['samples_per_sec']:>11.2f}"
+                    f"{result['tokens_per_sec']:>10.1f}{result['speedup']:>8.2f}x"
+                )
+
+    with open(output, "w") as f:
+        json.dump(
+            {"checkpoint": str(ckpt_path), "prompts": len(prompts), "results": results},
+            f,
+            indent=2,
+        )
+    logger.info(f"Wrote results to {output}")
+
+
+if __name__ == "__main__":
+    compare_prefix_caching()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Compares the similarity backends of the Kendall task ranking scorer on a test set:
+the time each backend takes to match the predicted tasks with the ground truth
+tasks, and how often the backends agree on the best match.
+"""
+import json
+import logging
+import sys
+import time
+from typing import List, Tuple
+
+import click
+import numpy as np
+
+from proc_gen import Problem
+from proc_gen.data.to_example import string_to_tasks
+from proc_gen.evaluate.similarity import SIMILARITY_BACKENDS, get_similarity
+
+logger = logging.getLogger("compare_similarity")
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.propagate = False
+logger.setLevel(logging.INFO)
+
+
+def read_predictions(path: str) -> List[str]:
+    """Reads hypotheses from a fairseq-generate log (D- lines), or one per line."""
+    with open(path, "r") as f:
+        lines = [l.rstrip("\n") for l in f]
+    if not any(l.startswith("D-") for l in lines):
+        return lines
+    hypotheses = {}
+    for line in lines:
+        if line.startswith("D-"):
+            _id, _, sent = line.split("\t", 2)
+            hypotheses.setdefault(int(_id[2:]), sent)
+    return [hypotheses[i] for i in sorted(hypotheses)]
+
+
+def task_pairs(
+    references: List[str], hypotheses: List[str], problem: Problem
+) -> List[Tuple[List[str], List[str]]]:
+    """
+    :return: (ground truth tasks, predicted tasks) of every procedure, lowercased and
+        as aligned by the Kendall task ranking scorer
+    """
+    parse_tp = problem in (
+        Problem.Requirements_TO_TargetProductAndTasks,
+        Problem.RequirementsAndTargetProductAndTasks,
+    )
+    pairs = []
+    for ref, hypo in zip(references, hypotheses):
+        try:
+            tasks_gt = string_to_tasks(ref, parse_tp=parse_tp)
+            tasks_pred = string_to_tasks(hypo, parse_tp=parse_tp)
+        except ValueError:
+            continue
+        if parse_tp:
+            tasks_gt, tasks_pred = tasks_gt[1:], tasks_pred[1:]
+        # Procedures the scorer skips (see compute_task_order_score)
+        if not tasks_gt or len(tasks_pred) < len(tasks_gt):
+            continue
+        pairs.append(
+            (
+                [t.lower() for t in tasks_gt],
+                [t.lower() for t in tasks_pred[: len(tasks_gt)]],
+            )
+        )
+    return pairs
+
+
+@click.command()
+@click.option(
+    "--references",
+    required=True,
+    help="Target side of the test set, e.g. test.TargetProductAndTasks.",
+)
+@click.option(
+    "--predictions",
+    required=True,
+    help="Predictions of the test set: a fairseq-generate log or one per line.",
+)
+@click.option(
+    "--problem",
+    type=click.Choice(Problem.__members__.keys()),
+    default=Problem.Requirements_TO_TargetProductAndTasks.name,
+)
+@click.option(
+    "--backend",
+    "backends",
+    type=click.Choice(list(SIMILARITY_BACKENDS)),
+    multiple=True,
+    default=["bert_score", "char_ngram"],
+    help="Backends to compare. The first one is the reference for the agreement.",
+)
+@click.option("--output", default="similarity_comparison.json", help="Results file.")
+def compare_similarity(references, predictions, problem, backends, output):
+    with open(references, "r") as f:
+        references = [l.rstrip("\n") for l in f]
+    pairs = task_pairs(references, read_predictions(predictions), Problem[problem])
+    if not pairs:
+        raise click.ClickException(
+            "No procedures with at least as many predicted as ground truth tasks."
+        )
+    num_matches = sum(len(tasks_pred) for _, tasks_pred in pairs)
+    logger.info(f"Matching {num_matches} tasks of {len(pairs)} procedures")
+
+    results, best_matches = {}, {}
+    for name in backends:
+        backend = get_similarity(name)
+        # Loads models (if any) outside of the timing
+        backend.similarities(["warm up"], ["warm up"])
+        start = time.perf_counter()
+        best_matches[name] = np.concatenate(
+            [backend.best_matches(pred, gt) for gt, pred in pairs]
+        )
+        seconds = time.perf_counter() - start
+        results[name] = {"seconds": seconds, "matches_per_sec": num_matches / seconds}
+        logger.info(
+            f"{name:<12} {seconds:10.3f} s {num_matches / seconds:12.0f} matches/s"
+        )
+
+    reference = backends[0]
+    for name in backends[1:]:
+        agreement = float(np.mean(best_matches[name] == best_matches[reference]))
+        results[name]["agreement"] = agreement
+        speedup = results[reference]["seconds"] / results[name]["seconds"]
+        results[name]["speedup"] = speedup
+        logger.info(
+            f"{name} picks the same best match as {reference} for "
+            f"{agreement:.1%} of the tasks, {speedup:.1f}x as fast"
+        )
+
+    with open(output, "w") as f:
+        json.dump(
+            {"procedures": len(pairs), "matches": num_matches, "results": results},
+            f,
+            indent=2,
+        )
+    logger.info(f"Wrote results to {output}")
+
+
+if __name__ == "__main__":
+    compare_similarity()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Compares greedy decoding of a test set with fairseq's SequenceGenerator (--beam 1)
+against speculative greedy decoding with a small draft model: sentences/s, the
+tokens generated per decoder pass of the model, and whether the outputs are the
+same.
+"""
+import json
+import logging
+import sys
+import time
+from argparse import Namespace
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+import click
+import torch
+
+from proc_gen import TASK_TO_PROBLEMS
+from proc_gen.configs import ARCH_PARAM_TO_STRING
+from proc_gen.utils import get_ckpt_dir
+
+logger = logging.getLogger("compare_speculative_decoding")
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.propagate = False
+logger.setLevel(logging.INFO)
+
+
+def load_models_and_task(
+    data_bin: Path, ckpt_path: Path, draft_ckpt_path: Path, cpu: bool
+):
+    from fairseq import checkpoint_utils
+
+    models, _, task = checkpoint_utils.load_model_ensemble_and_task(
+        [str(ckpt_path)], arg_overrides={"data": str(data_bin)}
+    )
+    draft_models, _ = checkpoint_utils.load_model_ensemble(
+        [str(draft_ckpt_path)], task=task
+    )
+    model, draft_model = models[0].eval(), draft_models[0].eval()
+    if not cpu:
+        model.cuda()
+        draft_model.cuda()
+    task.load_dataset("test")
+    return model, draft_model, task
+
+
+def greedy_fn(task, model, max_len_b: int) -> Callable[[torch.Tensor], Tuple]:
+    """:return: function from a source sentence to its greedy translation"""
+    generator = task.build_generator([model], Namespace(beam=1, max_len_b=max_len_b))
+    device = next(model.parameters()).device
+
+    def generate(src_tokens: torch.Tensor) -> Tuple[torch.Tensor, int]:
+        src_tokens = src_tokens.to(device).unsqueeze(0)
+        sample = {
+            "net_input": {
+                "src_tokens": src_tokens,
+                "src_lengths": torch.tensor([src_tokens.size(1)], device=device),
+            }
+        }
+        tokens = task.inference_step(generator, [model], sample)[0][0]["tokens"]
+        # One decoder pass per token
+        return tokens.cpu(), len(tokens)
+
+    return generate
+
+
+def speculative_fn(
+    task, model, draft_model, max_len_b: int, num_draft_tokens: int
+) -> Callable[[torch.Tensor], Tuple]:
+    """:return: function from a source sentence to its speculative translation"""
+    from proc_gen.fairseq_ext.speculative import SpeculativeGreedyGenerator
+
+    generator = SpeculativeGreedyGenerator(
+        model,
+        draft_model,
+        task.target_dictionary,
+        num_draft_tokens=num_draft_tokens,
+        max_len_b=max_len_b,
+    )
+
+    def generate(src_tokens: torch.Tensor) -> Tuple[torch.Tensor, int]:
+        hypo = generator.generate(src_tokens)
+        return hypo["tokens"].cpu(), hypo["steps"]
+
+    return generate
+
+
+def run(
+    generate: Callable, sources: List[torch.Tensor], cuda: bool
+) -> Tuple[List[torch.Tensor], int, float]:
+    """
+    :return: (List[torch.Tensor]) translations, (int) decoder passes of the model,
+        (float) seconds spent generating
+    """
+    translations, steps = [], 0
+    start = time.perf_counter()
+    for src_tokens in sources:
+        tokens, num_steps = generate(src_tokens)
+        translations.append(tokens)
+        steps += num_steps
+    if cuda:
+        torch.cuda.synchronize()
+    return translations, steps, time.perf_counter() - start
+
+
+@click.command()
+@click.option(
+    "--data_dir",
+    default="/data/procgen/v1/processed",
+    help="Base dir of the processed train/val/test files.",
+)
+@click.option(
+    "--dataset",
+    type=click.Choice(["Recipe1M", "dummy", "synthetic"]),
+    help="Which dataset the models were trained on.",
+)
+@click.option(
+    "--problem",
+    type=click.Choice([p.name for p in TASK_TO_PROBLEMS["translation"]]),
+    default="Requirements_TO_TargetProductAndTasks",
+)
+@click.option(
+    "--model_arch",
+    type=click.Choice(["transformer", "bart"]),
+    default="bart",
+    help="Architecture of the model.",
+)
+@click.option("--version", type=int, default=0, help="Which model version.")
+@click.option("--checkpoint", default="checkpoint_best.pt", help="Checkpoint file.")
+@click.option("--draft_version", type=int, default=0, help="Draft transformer version.")
+@click.option(
+    "--draft_checkpoint", default="checkpoint_best.pt", help="Draft checkpoint file."
+)
+@click.option(
+    "--num_draft_tokens",
+    type=int,
+    multiple=True,
+    default=[2, 4, 8],
+    help="Tokens proposed by the draft model per step.",
+)
+@click.option(
+    "--max_sentences", type=int, default=100, help="Number of test sentences."
+)
+@click.option("--max_len_b", type=int, default=200, help="Max translation length.")
+@click.option(
+    "--cpu", is_flag=True, help="Generate on CPU, even if a GPU is available."
+)
+@click.option(
+    "--output", default="speculative_decoding_comparison.json", help="Results file."
+)
+def compare_speculative_decoding(
+    data_dir,
+    dataset,
+    problem,
+    model_arch,
+    version,
+    checkpoint,
+    draft_version,
+    draft_checkpoint,
+    num_draft_tokens,
+    max_sentences,
+    max_len_b,
+    cpu,
+    output,
+):
+    cpu = cpu or not torch.cuda.is_available()
+    data_dir = Path(data_dir) / problem / dataset / "fairseq"
+    ckpt_dir = get_ckpt_dir(data_dir, ARCH_PARAM_TO_STRING[model_arch], version)
+    draft_ckpt_dir = get_ckpt_dir(
+        data_dir, ARCH_PARAM_TO_STRING["transformer"], draft_version
+    )
+    model, draft_model, task = load_models_and_task(
+        data_dir / "data-bin/tokenized",
+        ckpt_dir / checkpoint,
+        draft_ckpt_dir / draft_checkpoint,
+        cpu,
+    )
+    dataset_ = task.dataset("test")
+    sources = [dataset_.src[i] for i in range(min(max_sentences, len(dataset_)))]
+    logger.info(
+        f"Translating {len(sources)} test sentences with {ckpt_dir / checkpoint}, "
+        f"draft {draft_ckpt_dir / draft_checkpoint}"
+    )
+
+    results = {}
+    with torch.no_grad():
+        greedy, steps, seconds = run(
+            greedy_fn(task, model, max_len_b), sources, not cpu
+        )
+        results["greedy"] = {
+            "seconds": seconds,
+            "sentences_per_sec": len(sources) / seconds,
+            "tokens_per_step": sum(map(len, greedy)) / steps,
+            "identical": 1.0,
+            "speedup": 1.0,
+        }
+        for k in num_draft_tokens:
+            translations, steps, seconds = run(
+                speculative_fn(task, model, draft_model, max_len_b, k),
+                sources,
+                not cpu,
+            )
+            identical = sum(map(torch.equal, greedy, translations))
+            results[f"speculative-{k}"] = {
+                "seconds": seconds,
+                "sentences_per_sec": len(sources) / seconds,
+                "tokens_per_step": sum(map(len, translations)) / steps,
+                "identical": identical / len(sources),
+                "speedup": results["greedy"]["seconds"] / seconds,
+            }
+
+    logger.info(
+        f"{'decoding':<16}{'sentences/s':>12}{'tokens/step':>12}{'identical':>10}"
+        f"{'speedup':>9}"
+    )
+    for name, result in results.items():
+        logger.info(
+            f"{name:<16}{result['sentences_per_sec']:>12.2f}"
+            f"{result['tokens_per_step']:>12.2f}{result['identical']:>10.1%}"
+            f"{result['speedup']:>8.2f}x"
+        )
+
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "checkpoint": str(ckpt_dir / checkpoint),
+                "draft_checkpoint": str(draft_ckpt_dir / draft_checkpoint),
+                "sentences": len(sources),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    logger.info(f"Wrote results to {output}")
+
+
+if __name__ == "__main__":
+    compare_speculative_decoding()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Benchmark suite of the proc_gen hot paths, on synthetic corpora of several sizes.
+Runs on CPU, without network access: the BPE encoder uses a small BPE learned from
+the benchmark corpus and the Kendall scorer the char n-gram similarity backend
+instead of BERTScore (see compare_similarity.py to compare both).
+
+Results are written as JSON and compared against a baseline (results of an earlier
+run), flagging benchmarks that got slower than the tolerance allows.
+"""
+import json
+import logging
+import platform
+import sys
+import tempfile
+import timeit
+from argparse import Namespace
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import click
+
+from proc_gen import Problem
+from proc_gen.data import SyntheticConfig, SyntheticCorpus
+from proc_gen.data import procedure_to_example, example_to_procedure
+
+from bpe_fixture import write_bpe_fixture
+
+logger = logging.getLogger("benchmarks")
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.propagate = False
+logger.setLevel(logging.INFO)
+
+PROBLEM = Problem.Requirements_TO_TargetProductAndTasks
+SIMILARITY = "char_ngram"
+BENCHMARKS: Dict[str, Callable] = OrderedDict()
+
+
+def benchmark(name: str):
+    """
+    Registers a benchmark: a function of a `Corpus` returning the code to time. If
+    that code has a `stats` attribute, its result (a dict) is added to the results.
+    """
+
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return register
+
+
+class Corpus:
+    """Benchmark inputs of one size, created when first needed."""
+
+    def __init__(self, size: int, work_dir: Path):
+        self.size = size
+        self.work_dir = work_dir
+        self._cache = {}
+
+    def _cached(self, key, create):
+        if key not in self._cache:
+            self._cache[key] = create()
+        return self._cache[key]
+
+    @property
+    def procedures(self):
+        def generate():
+            corpus = SyntheticCorpus(SyntheticConfig(num_procedures=self.size))
+            return [proc for proc, _ in corpus]
+
+        return self._cached("procedures", generate)
+
+    @property
+    def examples(self):
+        return self._cached(
+            "examples",
+            lambda: [procedure_to_example(p, PROBLEM) for p in self.procedures],
+        )
+
+    @property
+    def tokenized_examples(self):
+        from proc_gen.data.example_tokenizer import tokenize_example
+
+        return self._cached(
+            "tokenized_examples",
+            lambda: [tokenize_example(example) for example in self.examples],
+        )
+
+    @property
+    def hypotheses(self):
+        """Target sides with their tasks in reverse order, as stand-in predictions."""
+        from proc_gen.data.to_example import string_to_tasks, tasks_to_string
+
+        def reorder(tgt):
+            target_product, *tasks = string_to_tasks(tgt, parse_tp=True)
+            return tasks_to_string(tasks[::-1], tp=target_product)
+
+        return self._cached(
+            "hypotheses", lambda: [reorder(e.tgt) for e in self.tokenized_examples]
+        )
+
+
+@benchmark("procedure_to_example")
+def bench_procedure_to_example(corpus: Corpus):
+    procedures = corpus.procedures
+    return lambda: [procedure_to_example(p, PROBLEM) for p in procedures]
+
+
+@benchmark("example_to_procedure")
+def bench_example_to_procedure(corpus: Corpus):
+    examples = corpus.examples
+    return lambda: [example_to_procedure(e, PROBLEM) for e in examples]
+
+
+@benchmark("tokenize_example")
+def bench_tokenize_example(corpus: Corpus):
+    from proc_gen.data.example_tokenizer import get_segment_tokenizer, tokenize_example
+
+    examples = corpus.examples
+    segment_tokenizer = get_segment_tokenizer()
+
+    def run():
+        # Cold cache, as in a single pass over a dataset
+        segment_tokenizer.clear()
+        return [tokenize_example(example) for example in examples]
+
+    run.stats = segment_tokenizer.stats
+    return run
+
+
+@benchmark("tokenize_example_unsegmented")
+def bench_tokenize_example_unsegmented(corpus: Corpus):
+    from proc_gen.data.example_tokenizer import moses_tokenize
+
+    examples = corpus.examples
+    return lambda: [(moses_tokenize(e.src), moses_tokenize(e.tgt)) for e in examples]
+
+
+@benchmark("encode_lines")
+def bench_encode_lines(corpus: Corpus):
+    from proc_gen.data.multiprocessing_bpe_encoder import MultiprocessingEncoder
+
+    lines = [(e.src, e.tgt) for e in corpus.tokenized_examples]
+    encoder_json, vocab_bpe = write_bpe_fixture(
+        (line for pair in lines for line in pair), corpus.work_dir / "bpe"
+    )
+    encoder = MultiprocessingEncoder(
+        Namespace(encoder_json=str(encoder_json), vocab_bpe=str(vocab_bpe))
+    )
+    # Loads the BPE in this process, as the encoder's pool workers do
+    encoder.initializer()
+    encoder.args.keep_empty = True
+    return lambda: [encoder.encode_lines(pair) for pair in lines]
+
+
+@benchmark("compute_requirement_coverage")
+def bench_requirement_coverage(corpus: Corpus):
+    from proc_gen.evaluate.scorers import compute_requirement_coverage
+
+    pairs = [(e.src, h) for e, h in zip(corpus.examples, corpus.hypotheses)]
+    return lambda: [
+        compute_requirement_coverage(hypo, src, problem=PROBLEM.name)
+        for src, hypo in pairs
+    ]
+
+
+@benchmark("kendall_task_ranking")
+def bench_kendall(corpus: Corpus):
+    from proc_gen.evaluate import scorers
+
+    scorer = scorers.KendallTaskRankingScorer(
+        corpus_level=True,
+        sent_level=False,
+        extra_args={"problem": PROBLEM.name, "similarity": SIMILARITY},
+    )
+    references = [[e.tgt for e in corpus.tokenized_examples]]
+    hypotheses = corpus.hypotheses
+    return lambda: scorer.score(hypotheses, references)
+
+
+@benchmark("get_scores")
+def bench_get_scores(corpus: Corpus):
+    from proc_gen.evaluate import get_scores
+
+    sources = {"src": [e.src for e in corpus.tokenized_examples]}
+    references = {"ref": [e.tgt for e in corpus.tokenized_examples]}
+    hypotheses = {"model": corpus.hypotheses}
+    return lambda: get_scores(
+        sources,
+        references,
+        hypotheses,
+        ["req_cov", "essential_req_cov", "kendall_task_ranking"],
+        problem=PROBLEM.name,
+        similarity=SIMILARITY,
+    )
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    :return: (List[str]) benchmarks (name/size) more than `tolerance` (a fraction of
+        the baseline time) slower than their baseline
+    """
+    regressions = []
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            base = baseline.get(name, {}).get(size)
+            if base is None or "seconds" not in result or "seconds" not in base:
+                continue
+            ratio = result["seconds"] / base["seconds"]
+            result["baseline_ratio"] = ratio
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name}/{size}")
+                logger.warning(
+                    f"REGRESSION {name} at {size}: {result['seconds']:.3f} s, "
+                    f"{ratio:.2f}x the baseline ({base['seconds']:.3f} s)"
+                )
+    return regressions
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    type=int,
+    multiple=True,
+    default=[100, 1000],
+    help="Number of procedures in the benchmark corpus.",
+)
+@click.option(
+    "--benchmark",
+    "names",
+    type=click.Choice(list(BENCHMARKS)),
+    multiple=True,
+    help="Benchmarks to run (all by default).",
+)
+@click.option("--repeat", type=int, default=3, help="Best of this many runs.")
+@click.option("--output", default="benchmark_results.json", help="Results file.")
+@click.option(
+    "--baseline",
+    default=None,
+    help="Results of an earlier run (e.g. benchmarks/baseline.json) to compare to.",
+)
+@click.option(
+    "--tolerance",
+    type=float,
+    default=0.2,
+    help="Flag benchmarks more than this fraction slower than the baseline.",
+)
+def run_benchmarks(sizes, names, repeat, output, baseline, tolerance):
+    names = names or list(BENCHMARKS)
+    results = {name: {} for name in names}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sorted(sizes):
+            corpus = Corpus(size, Path(work_dir) / str(size))
+            for name in names:
+                try:
+                    fn = BENCHMARKS[name](corpus)
+                except ImportError as e:
+                    logger.warning(f"Skipping {name}: {e}")
+                    results[name][str(size)] = {"skipped": str(e)}
+                    continue
+                seconds = min(timeit.repeat(fn, number=1, repeat=repeat))
+                results[name][str(size)] = {
+                    "seconds": seconds,
+                    "items_per_sec": size / seconds,
+                    **(fn.stats() if hasattr(fn, "stats") else {}),
+                }
+                logger.info(
+                    f"{name:<30} {size:>8} {seconds * 1000:10.1f} ms "
+                    f"{size / seconds:12.0f} procedures/s"
+                )
+
+    regressions = []
+    if baseline:
+        with open(baseline, "r") as f:
+            regressions = compare(results, json.load(f)["results"], tolerance)
+
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "meta": {
+                    "date": datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "repeat": repeat,
+                },
+                "results": results,
+                "regressions": regressions,
+            },
+            f,
+            indent=2,
+        )
+    logger.info(f"Wrote results to {output}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_benchmarks()
@@ -16,7 +16,42 @@
 # COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import json
+from argparse import Namespace
+
 from proc_gen.configs import transformer_conf
 from proc_gen.configs import bart_conf
 from proc_gen.configs import gpt2_conf
 from proc_gen.configs import dummy_conf
+
+ARCH_PARAM_TO_STRING = {
+    "lstm": "lstm",
+    "conv": "fconv_wmt_en_de",
+    "transformer": "transformer_iwslt_de_en",  #'transformer_wmt_en_de', transformer_wmt_en_de_big
+    "bart": "bart_large",
+    "gpt2": "transformer_lm_gpt2_small",  # 124M param model
+}
+
+ARCH_PARAM_TO_CONF = {
+    "lstm": dummy_conf,
+    "conv": dummy_conf,
+    "transformer": transformer_conf,
+    "bart": bart_conf,
+    "gpt2": gpt2_conf,
+}
+
+
+def load_conf_override(path: str) -> dict:
+    """Reads training arguments to override from a JSON file (e.g. written by
+    pg-find-batch-size)."""
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def apply_conf_override(train_args: Namespace, conf_override: dict) -> Namespace:
+    for arg, value in conf_override.items():
+        if not hasattr(train_args, arg):
+            raise ValueError(f"Unknown training argument {arg} in config override.")
+        setattr(train_args, arg, value)
+
+    return train_args
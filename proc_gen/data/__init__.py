@@ -20,6 +20,7 @@ from proc_gen.data import from_recipe1M
 from proc_gen.data import from_dummy
 
 from proc_gen.data import to_example
+from proc_gen.data import codec
 
 from proc_gen.data import example_tokenizer
 
@@ -27,6 +28,7 @@ from proc_gen.data.from_recipe1M import *
 from proc_gen.data.from_dummy import *
 
 from proc_gen.data.to_example import *
+from proc_gen.data.codec import *
 
 from proc_gen.data.example_tokenizer import *
 
@@ -34,5 +36,6 @@ __all__ = (
     from_recipe1M.__all__
     + from_dummy.__all__
     + to_example.__all__
+    + codec.__all__
     + example_tokenizer.__all__
 )
@@ -0,0 +1,306 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from array import array
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+from proc_gen.data.schema import Procedure, Method, Requirement
+
+__all__ = [
+    "ProcedureBatch",
+    "ProcedureView",
+    "MethodView",
+    "RequirementView",
+]
+
+# Tri-state encoding of Requirement.optional (None, False, True)
+OPTIONAL_UNSET = -1
+
+
+class StringColumn:
+    """Flat utf-8 buffer holding `n` strings, delimited by `n + 1` offsets.
+
+    `data` can be any object exposing the buffer protocol (bytearray, bytes,
+    numpy (mem)map), so the same column type serves in-memory and on-disk batches.
+    """
+
+    __slots__ = ("data", "offsets", "_view")
+
+    def __init__(self, data, offsets: Sequence[int]):
+        self.data = data
+        self.offsets = offsets
+        self._view = memoryview(data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return str(self._view[self.offsets[index] : self.offsets[index + 1]], "utf-8")
+
+
+class StringColumnBuilder:
+    __slots__ = ("data", "offsets")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("q", [0])
+
+    def append(self, string: str):
+        self.data += string.encode("utf-8")
+        self.offsets.append(len(self.data))
+
+    def build(self) -> StringColumn:
+        return StringColumn(self.data, self.offsets)
+
+
+class RequirementView:
+    """Read-only, `Requirement`-compatible view on a requirement in a batch."""
+
+    __slots__ = ("_batch", "_index")
+
+    def __init__(self, batch: "ProcedureBatch", index: int):
+        self._batch = batch
+        self._index = index
+
+    @property
+    def object(self) -> str:
+        return self._batch.requirement_objects[self._index]
+
+    @property
+    def quantity(self) -> str:
+        return self._batch.requirement_quantities[self._index]
+
+    @property
+    def optional(self) -> Optional[bool]:
+        optional = self._batch.requirement_optional[self._index]
+        return None if optional == OPTIONAL_UNSET else bool(optional)
+
+    to_string = Requirement.to_string
+    __str__ = Requirement.__str__
+
+    def __repr__(self):
+        return (
+            f"RequirementView(object={self.object!r}, quantity={self.quantity!r}, "
+            f"optional={self.optional!r})"
+        )
+
+    def to_requirement(self) -> Requirement:
+        return Requirement(
+            object=self.object, quantity=self.quantity, optional=self.optional
+        )
+
+
+class MethodView:
+    """Read-only, `Method`-compatible view on a method in a batch."""
+
+    __slots__ = ("_batch", "_index")
+
+    def __init__(self, batch: "ProcedureBatch", index: int):
+        self._batch = batch
+        self._index = index
+
+    @property
+    def requirements(self) -> List[RequirementView]:
+        offsets = self._batch.requirement_offsets
+        return [
+            RequirementView(self._batch, i)
+            for i in range(offsets[self._index], offsets[self._index + 1])
+        ]
+
+    @property
+    def tasks(self) -> List[str]:
+        offsets = self._batch.task_offsets
+        tasks = self._batch.tasks
+        return [
+            tasks[i] for i in range(offsets[self._index], offsets[self._index + 1])
+        ]
+
+    __str__ = Method.__str__
+
+    def __repr__(self):
+        return f"MethodView(requirements={self.requirements!r}, tasks={self.tasks!r})"
+
+    def to_method(self) -> Method:
+        return Method(
+            requirements=[req.to_requirement() for req in self.requirements],
+            tasks=self.tasks,
+        )
+
+
+class ProcedureView:
+    """Read-only, `Procedure`-compatible view on a procedure in a batch.
+
+    Strings are only decoded from the batch buffers when an attribute is accessed.
+    """
+
+    __slots__ = ("_batch", "_index")
+
+    def __init__(self, batch: "ProcedureBatch", index: int):
+        self._batch = batch
+        self._index = index
+
+    @property
+    def target_product(self) -> str:
+        return self._batch.target_products[self._index]
+
+    @property
+    def methods(self) -> List[MethodView]:
+        offsets = self._batch.method_offsets
+        return [
+            MethodView(self._batch, i)
+            for i in range(offsets[self._index], offsets[self._index + 1])
+        ]
+
+    __str__ = Procedure.__str__
+
+    def __repr__(self):
+        return (
+            f"ProcedureView(target_product={self.target_product!r}, "
+            f"methods={self.methods!r})"
+        )
+
+    def to_procedure(self) -> Procedure:
+        return Procedure(
+            target_product=self.target_product,
+            methods=[method.to_method() for method in self.methods],
+        )
+
+
+class ProcedureBatch:
+    """Columnar storage for many procedures.
+
+    All strings of a field live in one flat buffer (see `StringColumn`) and the
+    procedure -> method -> requirement/task nesting is kept in offset arrays:
+    procedure `i` owns methods `method_offsets[i]:method_offsets[i + 1]`, method `j`
+    owns requirements `requirement_offsets[j]:requirement_offsets[j + 1]` and tasks
+    `task_offsets[j]:task_offsets[j + 1]`.
+
+    Indexing returns `ProcedureView`s, which expose the `Procedure` API without
+    materializing the object graph.
+    """
+
+    __slots__ = (
+        "target_products",
+        "method_offsets",
+        "requirement_offsets",
+        "task_offsets",
+        "requirement_objects",
+        "requirement_quantities",
+        "requirement_optional",
+        "tasks",
+    )
+
+    def __init__(
+        self,
+        target_products: StringColumn,
+        method_offsets: Sequence[int],
+        requirement_offsets: Sequence[int],
+        task_offsets: Sequence[int],
+        requirement_objects: StringColumn,
+        requirement_quantities: StringColumn,
+        requirement_optional: Sequence[int],
+        tasks: StringColumn,
+    ):
+        self.target_products = target_products
+        self.method_offsets = method_offsets
+        self.requirement_offsets = requirement_offsets
+        self.task_offsets = task_offsets
+        self.requirement_objects = requirement_objects
+        self.requirement_quantities = requirement_quantities
+        self.requirement_optional = requirement_optional
+        self.tasks = tasks
+
+    @staticmethod
+    def from_procedures(procedures: Iterable[Procedure]) -> "ProcedureBatch":
+        builder = ProcedureBatchBuilder()
+        for proc in procedures:
+            builder.append(proc)
+
+        return builder.build()
+
+    def __len__(self):
+        return len(self.target_products)
+
+    def __getitem__(self, index: int) -> ProcedureView:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Procedure index {index} out of range.")
+
+        return ProcedureView(self, index)
+
+    def __iter__(self) -> Iterator[ProcedureView]:
+        for i in range(len(self)):
+            yield ProcedureView(self, i)
+
+    def to_procedures(self) -> List[Procedure]:
+        return [view.to_procedure() for view in self]
+
+
+STRING_COLUMNS = [
+    "target_products",
+    "requirement_objects",
+    "requirement_quantities",
+    "tasks",
+]
+
+
+class ProcedureBatchBuilder:
+    """Incrementally builds a `ProcedureBatch`, one procedure at a time.
+
+    :param column_builder: called with each name in `STRING_COLUMNS`, returns the
+        builder for that string column (in-memory `StringColumnBuilder` by default).
+    """
+
+    def __init__(self, column_builder=lambda name: StringColumnBuilder()):
+        self.target_products = column_builder("target_products")
+        self.method_offsets = array("q", [0])
+        self.requirement_offsets = array("q", [0])
+        self.task_offsets = array("q", [0])
+        self.requirement_objects = column_builder("requirement_objects")
+        self.requirement_quantities = column_builder("requirement_quantities")
+        self.requirement_optional = array("b")
+        self.tasks = column_builder("tasks")
+
+    def append(self, proc: Procedure):
+        self.target_products.append(proc.target_product)
+        for method in proc.methods:
+            for req in method.requirements:
+                self.requirement_objects.append(req.object)
+                # Requirement.to_string assumes string quantities
+                self.requirement_quantities.append(str(req.quantity or ""))
+                self.requirement_optional.append(
+                    OPTIONAL_UNSET if req.optional is None else int(req.optional)
+                )
+            for task in method.tasks:
+                self.tasks.append(task)
+            self.requirement_offsets.append(len(self.requirement_optional))
+            self.task_offsets.append(len(self.tasks.offsets) - 1)
+        self.method_offsets.append(len(self.requirement_offsets) - 1)
+
+    def build(self) -> ProcedureBatch:
+        return ProcedureBatch(
+            target_products=self.target_products.build(),
+            method_offsets=self.method_offsets,
+            requirement_offsets=self.requirement_offsets,
+            task_offsets=self.task_offsets,
+            requirement_objects=self.requirement_objects.build(),
+            requirement_quantities=self.requirement_quantities.build(),
+            requirement_optional=self.requirement_optional,
+            tasks=self.tasks.build(),
+        )
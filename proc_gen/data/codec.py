@@ -0,0 +1,261 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import re
+from functools import lru_cache
+from operator import itemgetter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from proc_gen.data.schema import Procedure, Method, Requirement
+from proc_gen.data.to_example import (
+    FIELD_TO_SEP,
+    PROBLEM_TO_LAYOUT,
+    REQUIREMENTS,
+    SPECIAL_TOKENS,
+    TARGET_PRODUCT,
+    TARGET_PRODUCT_SEP,
+    TASKS,
+    TranslationExample,
+)
+from proc_gen.problems import Problem
+
+__all__ = [
+    "ExampleCodec",
+    "get_codec",
+    "procedures_to_examples",
+    "examples_to_procedures",
+]
+
+
+def requirement_to_string(req: Requirement) -> str:
+    """Same as `Requirement.to_string`, for any object with requirement attributes."""
+    req_str = req.object
+    if req.quantity:
+        req_str += " (" + req.quantity + ")"
+    if req.optional:
+        req_str += " - optional"
+    return req_str
+
+
+@lru_cache(maxsize=2 ** 16)
+def _parse_requirement(req_str: str) -> Tuple[str, str, bool]:
+    if " (" not in req_str:
+        return req_str, "", False
+
+    obj, _, rest = req_str.partition(" (")
+    if " (" in rest:
+        raise ValueError(f"Requirement {req_str!r} contains multiple quantities.")
+
+    quantity, sep, rest = rest.partition(")")
+    if not sep:
+        return obj, "", False
+    if ")" in rest:
+        raise ValueError(f"Requirement {req_str!r} contains multiple quantities.")
+
+    return obj, quantity.strip(), bool(rest)
+
+
+def string_to_requirement(req_str: str) -> Requirement:
+    """
+    Same as `Requirement.from_string`, including the ValueError on ambiguous input.
+    Requirements repeat throughout a dataset, so their parts are cached.
+    """
+    # Positional arguments: noticeably cheaper for the dataclass __init__
+    return Requirement(*_parse_requirement(req_str))
+
+
+FIELDS = (TARGET_PRODUCT, REQUIREMENTS, TASKS)
+_REQUIREMENT_SEP = f" {FIELD_TO_SEP[REQUIREMENTS]} "
+_TASK_SEP = f" {FIELD_TO_SEP[TASKS]} "
+
+
+class _SideCodec:
+    """Encodes/decodes one side (src or tgt) of an example with a fixed layout."""
+
+    def __init__(self, layout: Sequence[str]):
+        self.layout = tuple(layout)
+        self.has_tp = TARGET_PRODUCT in self.layout
+        layout_no_tp = self._drop_tp(self.layout)
+
+        # %-format strings and getters of their (target product, requirements, tasks)
+        # values, for the side with and without target product
+        self.template, self.getter = self._template(self.layout)
+        self.template_no_tp, self.getter_no_tp = self._template(layout_no_tp)
+
+        # Fields, in order, and the separators expected between them
+        self.fields = [item for item in self.layout if item not in SPECIAL_TOKENS]
+        self.seps = [item for item in self.layout if item in SPECIAL_TOKENS]
+        self.fields_no_tp = [f for f in self.fields if f != TARGET_PRODUCT]
+        self.seps_no_tp = [item for item in layout_no_tp if item in SPECIAL_TOKENS]
+        # Single regex splitting the side on its top-level separators
+        self.sep_re = (
+            re.compile(" (" + "|".join(map(re.escape, set(self.seps))) + ") ")
+            if self.seps
+            else None
+        )
+
+    @staticmethod
+    def _drop_tp(layout):
+        if TARGET_PRODUCT not in layout:
+            return layout
+        i = layout.index(TARGET_PRODUCT)
+        if i + 1 < len(layout) and layout[i + 1] == TARGET_PRODUCT_SEP:
+            return layout[:i] + layout[i + 2 :]
+        return layout[: max(i - 1, 0)] + layout[i + 1 :]
+
+    @staticmethod
+    def _template(layout):
+        template = " ".join(item if item in SPECIAL_TOKENS else "%s" for item in layout)
+        indices = [FIELDS.index(item) for item in layout if item not in SPECIAL_TOKENS]
+        if not indices:
+            return template, lambda values: ()
+        # Returns a single value for a single index, which %-formatting accepts
+        return template, itemgetter(*indices)
+
+    def encode(self, values: Tuple[str, str, str]) -> str:
+        if values[0] or not self.has_tp:
+            return self.template % self.getter(values)
+        return self.template_no_tp % self.getter_no_tp(values)
+
+    def decode(self, string: str, fields: dict):
+        if self.sep_re is None:
+            parts = [string]
+            seps = []
+        else:
+            parts = self.sep_re.split(string)
+            parts, seps = parts[::2], parts[1::2]
+
+        if seps == self.seps:
+            names = self.fields
+        elif self.has_tp and seps == self.seps_no_tp:
+            names = self.fields_no_tp
+        else:
+            raise ValueError(
+                f"Expected separators {self.seps} in {string!r}, found {seps}."
+            )
+
+        for name, part in zip(names, parts):
+            if name == TARGET_PRODUCT:
+                fields[TARGET_PRODUCT] = part
+            elif name == REQUIREMENTS:
+                fields[REQUIREMENTS] = list(
+                    map(string_to_requirement, part.split(_REQUIREMENT_SEP))
+                )
+            else:
+                fields[TASKS] = part.split(_TASK_SEP)
+
+
+class ExampleCodec:
+    """
+    Converts procedures to examples and back for one problem, following its layout
+    in `PROBLEM_TO_LAYOUT`. Separators, format strings and regexes are prepared once,
+    so converting many examples only costs string joins and splits.
+
+    Encoding gives the same examples as `procedure_to_example`. Decoding is its exact
+    inverse for every problem, including the language modeling ones, and raises
+    ValueError when a side doesn't contain the expected separators.
+    """
+
+    def __init__(self, problem: Problem):
+        if problem not in PROBLEM_TO_LAYOUT:
+            raise NotImplementedError(f"No example layout for problem {problem}.")
+        self.problem = problem
+        src_layout, tgt_layout = PROBLEM_TO_LAYOUT[problem]
+        self.src = _SideCodec(src_layout)
+        self.tgt = _SideCodec(tgt_layout)
+        # Only join the fields used by the problem
+        layouts = src_layout + tgt_layout
+        self.needs_requirements = REQUIREMENTS in layouts
+        self.needs_tasks = TASKS in layouts
+
+    def encode(self, proc: Procedure) -> TranslationExample:
+        method = proc.methods[0]
+        values = (
+            proc.target_product,
+            _REQUIREMENT_SEP.join(
+                [
+                    # Most requirements consist of an object only
+                    req.object
+                    if not (req.quantity or req.optional)
+                    else requirement_to_string(req)
+                    for req in method.requirements
+                ]
+            )
+            if self.needs_requirements
+            else "",
+            _TASK_SEP.join(method.tasks) if self.needs_tasks else "",
+        )
+
+        return TranslationExample(
+            src=self.src.encode(values), tgt=self.tgt.encode(values)
+        )
+
+    def decode(self, example: TranslationExample) -> Procedure:
+        fields = {TARGET_PRODUCT: "", REQUIREMENTS: [], TASKS: []}
+        self.src.decode(example.src, fields)
+        self.tgt.decode(example.tgt, fields)
+
+        return Procedure(
+            target_product=fields[TARGET_PRODUCT],
+            methods=[Method(requirements=fields[REQUIREMENTS], tasks=fields[TASKS])],
+        )
+
+    def encode_batch(self, procs: Iterable[Procedure]) -> List[TranslationExample]:
+        encode = self.encode
+        return [encode(proc) for proc in procs]
+
+    def decode_batch(
+        self, examples: Iterable[TranslationExample], errors: str = "raise"
+    ) -> List[Optional[Procedure]]:
+        """
+        :param errors: (str) 'raise' to raise on unparsable examples,
+            'ignore' to return None for them instead
+        """
+        if errors == "raise":
+            decode = self.decode
+            return [decode(example) for example in examples]
+
+        procs = []
+        for example in examples:
+            try:
+                procs.append(self.decode(example))
+            except ValueError:
+                procs.append(None)
+        return procs
+
+
+# Dispatch table with a precompiled codec per problem
+PROBLEM_TO_CODEC = {problem: ExampleCodec(problem) for problem in PROBLEM_TO_LAYOUT}
+
+
+def get_codec(problem: Problem) -> ExampleCodec:
+    if problem not in PROBLEM_TO_CODEC:
+        raise NotImplementedError(f"No example layout for problem {problem}.")
+    return PROBLEM_TO_CODEC[problem]
+
+
+def procedures_to_examples(
+    procs: Iterable[Procedure], problem: Problem
+) -> List[TranslationExample]:
+    return get_codec(problem).encode_batch(procs)
+
+
+def examples_to_procedures(
+    examples: Iterable[TranslationExample], problem: Problem, errors: str = "raise"
+) -> List[Optional[Procedure]]:
+    return get_codec(problem).decode_batch(examples, errors=errors)
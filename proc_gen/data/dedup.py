@@ -0,0 +1,226 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import re
+import zlib
+from collections import defaultdict
+from itertools import islice
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+from proc_gen.data.schema import Procedure, PARTITIONS
+
+__all__ = ["MinHasher", "find_near_duplicates", "select_representatives", "dedup"]
+
+# Hash values are taken modulo this prime, small enough for a * h + b to fit uint64
+_PRIME = (1 << 31) - 1
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text: str) -> List[str]:
+    """Lowercased alphanumeric words of `text`."""
+    return _WORD_RE.findall(text.lower())
+
+
+def procedure_shingles(proc: Procedure, ngram: int = 3) -> Set[str]:
+    """
+    Features of a procedure for near-duplicate detection: its normalized requirement
+    objects (quantities are ignored) and the word n-grams of its tasks.
+    """
+    shingles = set()
+    for method in proc.methods:
+        for req in method.requirements:
+            shingles.add("r:" + " ".join(normalize(req.object)))
+        for task in method.tasks:
+            words = normalize(task)
+            for i in range(max(len(words) - ngram + 1, 1)):
+                shingles.add("t:" + " ".join(words[i : i + ngram]))
+    return shingles
+
+
+class MinHasher:
+    """
+    MinHash signatures with `num_perm` universal hash functions
+    `(a * crc32(shingle) + b) mod p`. The fraction of equal signature values of two
+    procedures estimates the Jaccard similarity of their shingle sets.
+    """
+
+    def __init__(self, num_perm: int = 64, ngram: int = 3, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.ngram = ngram
+        self.a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def signatures(self, procs: Iterable[Procedure], chunk_size: int = 10000):
+        """
+        :return: (np.ndarray) uint32 array of shape (num procedures, num_perm)
+        """
+        chunks = []
+        procs = iter(procs)
+        while True:
+            chunk = list(islice(procs, chunk_size))
+            if not chunk:
+                break
+            chunks.append(self._signatures(chunk))
+        if not chunks:
+            return np.empty((0, self.num_perm), dtype=np.uint32)
+        return np.concatenate(chunks)
+
+    def _signatures(self, procs: List[Procedure]) -> np.ndarray:
+        hashes, counts = [], []
+        for proc in procs:
+            # Procedures without features get a single, empty shingle
+            shingles = procedure_shingles(proc, self.ngram) or {""}
+            hashes.extend(zlib.crc32(s.encode("utf-8")) for s in shingles)
+            counts.append(len(shingles))
+
+        # Hash all shingles of the chunk at once, then take the minimum per procedure
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        permuted = (hashes[:, None] * self.a + self.b) % _PRIME
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        return np.minimum.reduceat(permuted, starts, axis=0).astype(np.uint32)
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = np.arange(size)
+
+    def find(self, i: int) -> int:
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i: int, j: int):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def find_near_duplicates(
+    signatures: np.ndarray, bands: int = 8, threshold: float = 0.8
+) -> np.ndarray:
+    """
+    Clusters procedures with LSH banding: signatures are split into `bands` bands,
+    procedures sharing a band are candidates. Candidates are compared to the first
+    procedure of their bucket only and merged when their estimated Jaccard similarity
+    is at least `threshold`, which keeps the cost linear in the number of procedures.
+
+    :return: (np.ndarray) cluster id (index of the cluster's first procedure) per procedure
+    """
+    num_procs, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(f"Number of bands {bands} must divide num_perm {num_perm}.")
+    rows = num_perm // bands
+
+    clusters = _UnionFind(num_procs)
+    for band in range(bands):
+        band_signatures = np.ascontiguousarray(
+            signatures[:, band * rows : (band + 1) * rows]
+        )
+        buckets = defaultdict(list)
+        for i in range(num_procs):
+            buckets[band_signatures[i].tobytes()].append(i)
+
+        for members in buckets.values():
+            first = members[0]
+            for i in members[1:]:
+                if clusters.find(i) == clusters.find(first):
+                    continue
+                similarity = np.mean(signatures[first] == signatures[i])
+                if similarity >= threshold:
+                    clusters.union(first, i)
+
+    return np.array([clusters.find(i) for i in range(num_procs)])
+
+
+def select_representatives(
+    cluster_ids: np.ndarray, partitions: np.ndarray
+) -> np.ndarray:
+    """
+    Keeps one procedure per cluster. Test procedures are never removed: clusters
+    with test procedures keep all of them and drop their train and valid members,
+    so nothing leaks into the test set. Other clusters keep their first valid
+    procedure if any, else their first train procedure.
+
+    :param partitions: (np.ndarray) index into PARTITIONS per procedure
+    :return: (np.ndarray) boolean mask of the procedures to keep
+    """
+    test, valid = PARTITIONS.index("test"), PARTITIONS.index("valid")
+    keep = partitions == test
+
+    cluster_has_test = np.zeros(len(cluster_ids), dtype=bool)
+    cluster_has_test[cluster_ids[keep]] = True
+
+    representative = {}
+    for i in np.flatnonzero(~cluster_has_test[cluster_ids]):
+        cluster = cluster_ids[i]
+        # Prefer valid over train representatives
+        if cluster not in representative or (
+            partitions[i] == valid and partitions[representative[cluster]] != valid
+        ):
+            representative[cluster] = i
+    keep[list(representative.values())] = True
+
+    return keep
+
+
+def dedup(
+    procs_and_partitions: Iterable[Tuple[Procedure, str]],
+    num_perm: int = 64,
+    bands: int = 8,
+    threshold: float = 0.8,
+) -> Tuple[np.ndarray, Dict]:
+    """
+    Finds near-duplicate procedures and selects the ones to keep.
+
+    :return: (np.ndarray) boolean mask of the procedures to keep, and a report with
+        the number of procedures per partition before and after deduplication
+    """
+    partitions = []
+
+    def procs():
+        for proc, partition in procs_and_partitions:
+            partitions.append(PARTITIONS.index(partition))
+            yield proc
+
+    signatures = MinHasher(num_perm=num_perm).signatures(procs())
+    partitions = np.asarray(partitions, dtype=np.int8)
+    cluster_ids = find_near_duplicates(signatures, bands=bands, threshold=threshold)
+    keep = select_representatives(cluster_ids, partitions)
+
+    report = {
+        "num_perm": num_perm,
+        "bands": bands,
+        "threshold": threshold,
+        "num_clusters": int(len(np.unique(cluster_ids))),
+    }
+    for i, part in enumerate(PARTITIONS):
+        before = int(np.sum(partitions == i))
+        after = int(np.sum(keep & (partitions == i)))
+        report[part] = {
+            "before": before,
+            "after": after,
+            "removed_pct": 100 * (before - after) / before if before else 0.0,
+        }
+
+    return keep, report
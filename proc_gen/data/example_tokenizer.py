@@ -16,53 +16,266 @@
 # COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import re
 from copy import deepcopy
+from functools import lru_cache, partial
+from typing import Callable, Dict, List, Optional, Tuple
 
-__all__ = ["tokenize_example", "detokenize_example"]
+__all__ = [
+    "tokenize_example",
+    "detokenize_example",
+    "SegmentTokenizer",
+    "get_segment_tokenizer",
+    "get_segment_detokenizer",
+]
 
 from proc_gen.data.to_example import TranslationExample, SPECIAL_TOKENS, REQUIREMENT_SEP
 
+# Separators between segments, as joined by proc_gen.data.to_example
+SEGMENT_SEP_PATTERN = re.compile(
+    " (" + "|".join(map(re.escape, dict.fromkeys(SPECIAL_TOKENS))) + ") "
+)
 
-def tokenize_example(
-    example: TranslationExample, tokenizer="moses"
-) -> TranslationExample:
+# Stands in for the separators next to a segment. In a full string, Moses sees a
+# (protected) separator as a placeholder word, THISISPROTECTED000. A short word
+# starting with a capital, without a period, is tokenized the same way
+SEGMENT_CONTEXT = "S0"
+
+
+class SegmentTokenizer(object):
+    """
+    Tokenizes (or detokenizes) example strings segment by segment (target product,
+    requirements, tasks), as split by the special tokens. Segments such as "1 cup
+    sugar" repeat throughout a dataset, so each distinct segment is tokenized once,
+    through a bounded (LRU) cache.
+
+    Moses looks at the text next to a segment, e.g. a quote opening a segment
+    ("<eor> 'fresh' basil") is split off its word after a separator, but not at the
+    start of a string. A segment is therefore tokenized between context words on
+    the sides it has a separator, which are then removed, so the result is the same
+    as tokenizing the whole string. If a segment can't be tokenized on its own, the
+    whole string is.
+
+    :param tokenize_segment: (callable) tokenizes one segment (with its context
+        words), or returns None if it can't be tokenized on its own
+    :param tokenize_text: (callable) tokenizes a whole string, protecting the
+        special tokens
+    :param cache_size: (int) max number of cached segments, or None for no bound
+    """
+
+    def __init__(
+        self,
+        tokenize_segment: Callable[[str], Optional[str]],
+        tokenize_text: Callable[[str], str],
+        cache_size: Optional[int],
+    ):
+        self._tokenize_segment = tokenize_segment
+        self._tokenize_text = tokenize_text
+        self.tokenize_in_context = lru_cache(maxsize=cache_size)(self._in_context)
+
+    def _in_context(self, segment: str, left: bool, right: bool) -> Optional[str]:
+        """
+        :param left: (bool) the segment follows a separator
+        :param right: (bool) the segment is followed by a separator
+        :return: (str) tokenized segment, or None if it can't be tokenized on its own
+            (it's empty, or a context word doesn't stay a token of its own)
+        """
+        if not segment.strip():
+            return None
+        context = [SEGMENT_CONTEXT]
+        text = " ".join(context * left + [segment] + context * right)
+        tokenized = self._tokenize_segment(text)
+        if tokenized is None:
+            return None
+
+        tokens = tokenized.split(" ")
+        if len(tokens) <= left + right:
+            return None
+        if (left and tokens[0] != SEGMENT_CONTEXT) or (
+            right and tokens[-1] != SEGMENT_CONTEXT
+        ):
+            return None
+        return " ".join(tokens[int(left) : len(tokens) - int(right)])
+
+    def tokenize_pieces(self, pieces: List[str]) -> Optional[List[str]]:
+        """
+        :param pieces: (List[str]) segments and the separators between them, e.g. of
+            `layout_to_pieces`
+        :return: (List[str]) the pieces with tokenized segments, which joined by
+            spaces are the tokenized string, or None if a segment can't be tokenized
+            on its own
+        """
+        tokenized = []
+        for i, piece in enumerate(pieces):
+            if piece in SPECIAL_TOKENS:
+                tokenized.append(piece)
+                continue
+            if any(token in piece for token in SPECIAL_TOKENS):
+                # Separator without surrounding spaces
+                return None
+            piece = self.tokenize_in_context(piece, i > 0, i < len(pieces) - 1)
+            if piece is None:
+                return None
+            tokenized.append(piece)
+        return tokenized
+
+    def __call__(self, text: str) -> str:
+        pieces = self.tokenize_pieces(SEGMENT_SEP_PATTERN.split(text))
+        if pieces is None:
+            return self._tokenize_text(text)
+        return " ".join(pieces)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        :return: (dict) number of segments tokenized through the cache, how many of
+            them were tokenized (misses), and the dedup ratio (segments per miss)
+        """
+        info = self.tokenize_in_context.cache_info()
+        segments = info.hits + info.misses
+        return {
+            "segments": segments,
+            "tokenized": info.misses,
+            "dedup_ratio": segments / max(info.misses, 1),
+        }
+
+    def clear(self):
+        self.tokenize_in_context.cache_clear()
+
+
+_moses_tokenizer = None
+
+
+def moses_tokenize(text: str, protect_special_tokens: bool = True) -> str:
+    """Tokenizes with the (shared) Moses tokenizer."""
+    global _moses_tokenizer
+
+    if _moses_tokenizer is None:
+        from sacremoses import MosesTokenizer
+
+        class _MosesTokenizer(MosesTokenizer):
+            # sacremoses builds the set of all lowercase letters on every call, for
+            # every token ending with a period that isn't the last one
+            lowercase = frozenset(MosesTokenizer.IsLower)
+
+            def islower(self, text):
+                return not set(text).difference(self.lowercase)
+
+        _moses_tokenizer = _MosesTokenizer("en")
+
+    return _moses_tokenizer.tokenize(
+        text,
+        aggressive_dash_splits=True,
+        return_str=True,
+        escape=False,
+        # Protecting patterns doubles the tokenization time
+        protected_patterns=SPECIAL_TOKENS if protect_special_tokens else None,
+    )
+
+
+_moses_detokenizer = None
+
+
+def moses_detokenize(text: str) -> str:
+    """Detokenizes with the (shared) Moses detokenizer."""
+    global _moses_detokenizer
+
+    if _moses_detokenizer is None:
+        from sacremoses import MosesDetokenizer
+
+        _moses_detokenizer = MosesDetokenizer("en")
+
+    return _moses_detokenizer.detokenize(text.split())
+
+
+# Quote tokens, which the Moses detokenizer attaches to the next or previous token
+# depending on the number of quotes before them in the whole string
+_QUOTE_TOKEN_PATTERN = re.compile(r"""(?:^| )['"„“`]+(?= |$)""")
+
+
+def moses_detokenize_segment(text: str) -> Optional[str]:
+    """Detokenizes a segment, or returns None if it has quotes (see above)."""
+    if _QUOTE_TOKEN_PATTERN.search(text):
+        return None
+    return moses_detokenize(text)
+
+
+_segment_tokenizers: Dict[Tuple[str, bool], SegmentTokenizer] = {}
+
+
+def get_segment_tokenizer(
+    tokenizer="moses", cache_size: Optional[int] = 2 ** 20
+) -> SegmentTokenizer:
+    """:return: the (shared) segment tokenizer of `tokenizer`"""
     if tokenizer not in ("moses",):
         raise NotImplementedError("Only moses tokenizer currently supported.")
+    if (tokenizer, False) not in _segment_tokenizers:
+        _segment_tokenizers[tokenizer, False] = SegmentTokenizer(
+            # Segments contain no special tokens
+            partial(moses_tokenize, protect_special_tokens=False),
+            moses_tokenize,
+            cache_size,
+        )
+    return _segment_tokenizers[tokenizer, False]
 
-    example = deepcopy(example)
 
-    if tokenizer == "moses":
-        from sacremoses import MosesTokenizer
+def get_segment_detokenizer(
+    tokenizer="moses", cache_size: Optional[int] = 2 ** 20
+) -> SegmentTokenizer:
+    """:return: the (shared) segment detokenizer of `tokenizer`"""
+    if tokenizer != "moses":
+        raise NotImplementedError("Only moses tokenizer is currently supported.")
+    if (tokenizer, True) not in _segment_tokenizers:
+        _segment_tokenizers[tokenizer, True] = SegmentTokenizer(
+            moses_detokenize_segment, moses_detokenize, cache_size
+        )
+    return _segment_tokenizers[tokenizer, True]
 
-        tokenizer = MosesTokenizer("en")
-        tokenizer_kwargs = {
-            "aggressive_dash_splits": True,
-            "return_str": True,
-            "escape": False,
-            "protected_patterns": SPECIAL_TOKENS,  # Protect special tokens
-        }
-        tokenize = tokenizer.tokenize
 
-    example.src = tokenize(example.src, **tokenizer_kwargs)
-    example.tgt = tokenize(example.tgt, **tokenizer_kwargs)
+def tokenize_example(
+    example: TranslationExample, tokenizer="moses", segmented: bool = True
+) -> TranslationExample:
+    """
+    Tokenizes source and target of the example, segment by segment (see
+    `SegmentTokenizer`), which gives the same result as tokenizing the full strings.
+
+    :param segmented: (bool) False to tokenize the full strings instead, without
+        the segment cache
+    """
+    if segmented:
+        tokenize = get_segment_tokenizer(tokenizer)
+    elif tokenizer == "moses":
+        tokenize = moses_tokenize
+    else:
+        raise NotImplementedError("Only moses tokenizer currently supported.")
+
+    example = deepcopy(example)
+
+    example.src = tokenize(example.src)
+    example.tgt = tokenize(example.tgt)
 
     return example
 
 
 def detokenize_example(
-    example: TranslationExample, tokenizer="moses"
+    example: TranslationExample, tokenizer="moses", segmented: bool = True
 ) -> TranslationExample:
-    if tokenizer != "moses":
+    """
+    Detokenizes source and target of the example, segment by segment (see
+    `SegmentTokenizer`), which gives the same result as detokenizing the full strings.
+
+    :param segmented: (bool) False to detokenize the full strings instead, without
+        the segment cache
+    """
+    if segmented:
+        detokenize = get_segment_detokenizer(tokenizer)
+    elif tokenizer == "moses":
+        detokenize = moses_detokenize
+    else:
         raise NotImplementedError("Only moses tokenizer is currently supported.")
 
     example = deepcopy(example)
 
-    if tokenizer == "moses":
-        from sacremoses import MosesDetokenizer
-
-        tokenizer = MosesDetokenizer("en")
-
-    example.src = tokenizer.detokenize(example.src.split())
-    example.tgt = tokenizer.detokenize(example.tgt.split())
+    example.src = detokenize(example.src)
+    example.tgt = detokenize(example.tgt)
 
     return example
@@ -16,9 +16,16 @@
 # COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
-from proc_gen.data.schema import Procedure, Method, Requirement
+import json
+import os
+from dataclasses import dataclass, field, fields
+from typing import Dict, Iterator, List, Optional, Tuple
 
-__all__ = ["dummy_to_procedure"]
+import numpy as np
+
+from proc_gen.data.schema import Procedure, Method, Requirement, PARTITIONS
+
+__all__ = ["dummy_to_procedure", "SyntheticConfig", "SyntheticCorpus", "load_synthetic"]
 
 
 def dummy_to_procedure(index: int) -> (Procedure, str):
@@ -48,3 +55,180 @@ def dummy_to_procedure(index: int) -> (Procedure, str):
         partition = "train"
 
     return Procedure(target_product=target_product, methods=methods), partition
+
+
+_ONSETS = ["", "b", "c", "d", "f", "g", "h", "l", "m", "n", "p", "r", "s", "t", "v"]
+_ONSETS += ["br", "ch", "cr", "fl", "gr", "pl", "sh", "sp", "st", "tr", "th"]
+_VOWELS = ["a", "e", "i", "o", "u", "ai", "ea", "ee", "oa", "ou"]
+_CODAS = ["", "", "", "n", "r", "s", "t", "l", "m", "ck", "ng", "st"]
+_QUANTITIES = ["", "1 cup", "2 cups", "1/2 cup", "1 teaspoon", "1/2 teaspoon"]
+_QUANTITIES += ["1 tablespoon", "2 tablespoons", "1 pound", "3", "1", "2", "1 pinch"]
+
+
+@dataclass
+class SyntheticConfig:
+    """
+    Parameters of a synthetic procedure corpus. Lengths (in words or items) follow
+    log-normal distributions with the given means, words a Zipf distribution over
+    the vocabulary. Defaults roughly follow Recipe1M.
+    """
+
+    num_procedures: int = 1000000
+    seed: int = 1
+    # Vocabulary sizes of requirement objects and of the other (task) words
+    object_vocab_size: int = 5000
+    vocab_size: int = 20000
+    zipf_exponent: float = 1.1
+    requirements_mean: float = 9.0
+    tasks_mean: float = 10.0
+    task_words_mean: float = 12.0
+    target_product_words_mean: float = 3.5
+    object_words_mean: float = 1.8
+    length_sigma: float = 0.5
+    optional_prob: float = 0.05
+    # Probability that a task mentions one of the procedure's requirements
+    task_mentions_requirement_prob: float = 0.6
+    partition_ratios: Dict[str, float] = field(
+        default_factory=lambda: {"train": 0.7, "valid": 0.15, "test": 0.15}
+    )
+    chunk_size: int = 10000
+
+    @classmethod
+    def from_json(cls, path: str) -> "SyntheticConfig":
+        with open(path, "r") as f:
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise ValueError(f"Synthetic corpus config {path} must be a JSON object.")
+        unknown = set(config) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f"Unknown synthetic corpus parameters {sorted(unknown)}.")
+        return cls(**config)
+
+
+class SyntheticCorpus:
+    """
+    Seeded, streaming corpus of synthetic procedures, for load testing the pipeline.
+
+    Procedures are generated in chunks of `config.chunk_size`, each from its own
+    random generator, so the corpus is the same however it is consumed and never
+    held in memory at once. Iterating yields (Procedure, partition) tuples.
+    """
+
+    def __init__(self, config: Optional[SyntheticConfig] = None):
+        self.config = config or SyntheticConfig()
+        rng = np.random.default_rng([self.config.seed, 0])
+        self.objects = self._vocabulary(rng, self.config.object_vocab_size)
+        self.words = self._vocabulary(rng, self.config.vocab_size)
+        self.object_probs = self._zipf(self.config.object_vocab_size)
+        self.word_probs = self._zipf(self.config.vocab_size)
+
+        ratios = self.config.partition_ratios
+        if set(ratios) - set(PARTITIONS):
+            raise ValueError(f"Partition ratios must be of {PARTITIONS}: {ratios}")
+        self.partitions = np.array(list(ratios))
+        self.partition_probs = np.array(list(ratios.values())) / sum(ratios.values())
+
+    def __len__(self):
+        return self.config.num_procedures
+
+    def __iter__(self) -> Iterator[Tuple[Procedure, str]]:
+        chunk_size = self.config.chunk_size
+        for chunk, start in enumerate(range(0, len(self), chunk_size)):
+            yield from self.generate_chunk(chunk, min(chunk_size, len(self) - start))
+
+    @staticmethod
+    def _vocabulary(rng, size: int) -> np.ndarray:
+        """`size` distinct pronounceable words of 1 to 3 syllables."""
+        syllables = np.array(
+            [o + v + c for o in _ONSETS for v in _VOWELS for c in _CODAS], dtype=object
+        )
+        words = {}
+        while len(words) < size:
+            # Generate candidates in batches, duplicates are dropped
+            parts = syllables[rng.integers(len(syllables), size=(2 * size, 3))]
+            num_syllables = rng.integers(1, 4, size=2 * size)
+            for word_parts, n in zip(parts, num_syllables):
+                words["".join(word_parts[:n])] = None
+        return np.array(list(words)[:size], dtype=object)
+
+    def _zipf(self, size: int) -> np.ndarray:
+        probs = 1.0 / np.arange(1, size + 1) ** self.config.zipf_exponent
+        return probs / probs.sum()
+
+    def _lengths(self, rng, mean: float, size: int) -> np.ndarray:
+        """Log-normal lengths with mean `mean`, at least 1."""
+        sigma = self.config.length_sigma
+        lengths = rng.lognormal(np.log(mean) - sigma ** 2 / 2, sigma, size)
+        return np.maximum(np.rint(lengths), 1).astype(np.int64)
+
+    def _phrases(self, rng, vocab, probs, mean: float, size: int) -> List[str]:
+        lengths = self._lengths(rng, mean, size)
+        words = vocab[rng.choice(len(vocab), size=lengths.sum(), p=probs)]
+        ends = np.cumsum(lengths)
+        return [" ".join(words[end - n : end]) for n, end in zip(lengths, ends)]
+
+    def generate_chunk(self, chunk: int, size: int) -> List[Tuple[Procedure, str]]:
+        """Generates the `size` procedures of chunk `chunk`."""
+        config = self.config
+        # Chunk generators are seeded independently of the vocabulary's (chunk 0)
+        rng = np.random.default_rng([config.seed, chunk + 1])
+
+        num_reqs = self._lengths(rng, config.requirements_mean, size)
+        num_tasks = self._lengths(rng, config.tasks_mean, size)
+        total_reqs, total_tasks = num_reqs.sum(), num_tasks.sum()
+        objects = self._phrases(
+            rng, self.objects, self.object_probs, config.object_words_mean, total_reqs
+        )
+        tasks = self._phrases(
+            rng, self.words, self.word_probs, config.task_words_mean, total_tasks
+        )
+        target_products = self._phrases(
+            rng, self.words, self.word_probs, config.target_product_words_mean, size
+        )
+        quantities = rng.choice(_QUANTITIES, size=total_reqs)
+        optional = rng.random(total_reqs) < config.optional_prob
+        mentions = rng.random(total_tasks) < config.task_mentions_requirement_prob
+        mentioned = rng.random(total_tasks)
+        partitions = rng.choice(self.partitions, size=size, p=self.partition_probs)
+
+        procedures = []
+        req_end, task_end = np.cumsum(num_reqs), np.cumsum(num_tasks)
+        for i in range(size):
+            req_slice = slice(req_end[i] - num_reqs[i], req_end[i])
+            requirements = [
+                Requirement(object=obj, quantity=str(quantity), optional=bool(opt))
+                for obj, quantity, opt in zip(
+                    objects[req_slice], quantities[req_slice], optional[req_slice]
+                )
+            ]
+
+            proc_tasks = []
+            for j in range(task_end[i] - num_tasks[i], task_end[i]):
+                task = tasks[j]
+                if mentions[j]:
+                    obj = requirements[int(mentioned[j] * len(requirements))].object
+                    task = f"{task} {obj}"
+                proc_tasks.append(task[0].upper() + task[1:] + ".")
+
+            procedures.append(
+                (
+                    Procedure(
+                        target_product=target_products[i].title(),
+                        methods=[Method(requirements=requirements, tasks=proc_tasks)],
+                    ),
+                    str(partitions[i]),
+                )
+            )
+        return procedures
+
+
+def load_synthetic(config_path: Optional[str] = None) -> SyntheticCorpus:
+    """
+    Synthetic corpus with the parameters in the JSON file `config_path` (see
+    SyntheticConfig), or the default parameters if no file is given.
+    """
+    if config_path is None:
+        return SyntheticCorpus()
+    if not os.path.isfile(config_path):
+        raise FileNotFoundError(f"Synthetic corpus config not found: {config_path}")
+    return SyntheticCorpus(SyntheticConfig.from_json(config_path))
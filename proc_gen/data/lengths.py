@@ -0,0 +1,128 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import contextlib
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+__all__ = [
+    "LENGTH_POLICIES",
+    "line_lengths",
+    "length_histogram",
+    "apply_length_limits",
+]
+
+PathLike = Union[str, Path]
+
+# What to do with examples longer than the model limits
+LENGTH_POLICIES = ["none", "filter", "truncate"]
+
+
+def line_lengths(path: PathLike) -> np.ndarray:
+    """Number of (whitespace separated) tokens on each line of a file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return np.fromiter((len(line.split()) for line in f), dtype=np.int64)
+
+
+def length_histogram(lengths: np.ndarray, bin_size: int = 32) -> Dict:
+    """Summary statistics and a histogram with bins of `bin_size` tokens."""
+    if len(lengths) == 0:
+        return {"count": 0}
+
+    bins = lengths // bin_size * bin_size
+    starts, counts = np.unique(bins, return_counts=True)
+
+    return {
+        "count": int(len(lengths)),
+        "mean": float(lengths.mean()),
+        "p50": int(np.percentile(lengths, 50)),
+        "p90": int(np.percentile(lengths, 90)),
+        "p99": int(np.percentile(lengths, 99)),
+        "max": int(lengths.max()),
+        "bin_size": bin_size,
+        "bins": {int(start): int(count) for start, count in zip(starts, counts)},
+    }
+
+
+def apply_length_limits(
+    side_files: Sequence[Sequence[PathLike]],
+    side_lengths: Sequence[np.ndarray],
+    side_limits: Sequence[Optional[int]],
+    policy: str,
+    decode_bpe: Callable[[List[int]], str] = None,
+) -> np.ndarray:
+    """
+    Filters or truncates aligned files in place, so that no side of an example is
+    longer than its limit.
+
+    :param side_files: per side (src, tgt), the aligned (tokenized text, BPE ids,
+        decoded BPE ids) files holding that side
+    :param side_lengths: per side, the BPE length of each example
+    :param side_limits: per side, the maximum number of BPE tokens (None for no limit)
+    :param policy: 'filter' drops examples exceeding a limit from all files,
+        'truncate' keeps the first `limit` BPE ids of each line on that side, and
+        their decoding as tokenized and decoded text
+    :param decode_bpe: (Callable) decodes BPE ids to text, needed to truncate
+    :return: (np.ndarray) boolean mask of the examples that exceeded a limit
+    """
+    if policy not in LENGTH_POLICIES:
+        raise ValueError(
+            f"Unknown length policy {policy}, use one of {LENGTH_POLICIES}."
+        )
+    if policy == "truncate" and decode_bpe is None:
+        raise ValueError("Truncating needs a BPE decoder.")
+
+    too_long = np.zeros(len(side_lengths[0]), dtype=bool)
+    for lengths, limit in zip(side_lengths, side_limits):
+        if limit is not None:
+            too_long |= lengths > limit
+    if policy == "none" or not too_long.any():
+        return too_long
+
+    for paths, limit in zip(side_files, side_limits):
+        tmp_paths = [f"{path}.tmp" for path in paths]
+        with contextlib.ExitStack() as stack:
+            inputs = [
+                stack.enter_context(open(path, "r", encoding="utf-8"))
+                for path in paths
+            ]
+            text_out, bpe_out, decoded_out = [
+                stack.enter_context(open(path, "w", encoding="utf-8"))
+                for path in tmp_paths
+            ]
+            for (text, bpe, decoded), drop in zip(zip(*inputs), too_long):
+                if drop and policy == "filter":
+                    continue
+                ids = bpe.split()
+                if drop and limit is not None and len(ids) > limit:
+                    # Words take at least one BPE token each, so the decoded
+                    # text is within the limit as well
+                    ids = ids[:limit]
+                    bpe = " ".join(ids) + "\n"
+                    decoded = decode_bpe(list(map(int, ids))).strip() + "\n"
+                    text = decoded
+                text_out.write(text)
+                bpe_out.write(bpe)
+                decoded_out.write(decoded)
+        for path, tmp_path in zip(paths, tmp_paths):
+            os.replace(tmp_path, path)
+
+    return too_long
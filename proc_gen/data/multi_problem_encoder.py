@@ -0,0 +1,161 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from proc_gen.data.to_example import (
+    PROBLEM_TO_LAYOUT,
+    TranslationExample,
+    layout_to_pieces,
+)
+from proc_gen.problems import Problem
+
+__all__ = ["MultiProblemEncoder"]
+
+
+class MultiProblemEncoder(object):
+    """
+    Converts the fields of a procedure (see `procedure_to_fields`) into tokenized and
+    BPE-encoded examples for several problems at once.
+
+    Every segment (target product, requirement, task) is tokenized and BPE-encoded
+    once, after which the examples of each problem are assembled from the encoded
+    segments. Tokenized and encoded segments are cached (up to `cache_size` of each)
+    across procedures, as many of them repeat throughout a dataset. Meant to be used
+    as `multiprocessing.Pool` worker, like `MultiprocessingEncoder`.
+
+    Note: a segment is tokenized in the context of its separators, which depends on
+    where the problem's layout puts it (see `SegmentTokenizer`), so the tokenized
+    examples equal those of full-string tokenization. With `segmented=False`, the
+    example of every problem is tokenized and BPE-encoded as a whole instead, like
+    `tokenize_example(example, segmented=False)`, without sharing segments.
+    """
+
+    def __init__(
+        self,
+        problems: List[Problem],
+        tokenizer: str = None,
+        encoder_json: str = None,
+        vocab_bpe: str = None,
+        cache_size: Optional[int] = 2 ** 20,
+        segmented: bool = True,
+    ):
+        for problem in problems:
+            if problem not in PROBLEM_TO_LAYOUT:
+                raise NotImplementedError(f"No example layout for problem {problem}.")
+        if tokenizer not in (None, "moses"):
+            raise NotImplementedError("Only moses tokenizer currently supported.")
+
+        self.problems = problems
+        self.tokenizer = tokenizer
+        self.encoder_json = encoder_json
+        self.vocab_bpe = vocab_bpe
+        self.cache_size = cache_size
+        self.segmented = segmented
+
+    def initializer(self):
+        global bpe, encode_piece, tokenize, tokenize_text
+
+        bpe = None
+        if self.encoder_json:
+            from fairseq.data.encoders.gpt2_bpe import get_encoder
+
+            bpe = get_encoder(self.encoder_json, self.vocab_bpe)
+
+            @lru_cache(maxsize=self.cache_size)
+            def encode_piece(piece):
+                return " ".join(map(str, bpe.encode(piece)))
+
+        tokenize, tokenize_text = None, None
+        if self.tokenizer:
+            from proc_gen.data.example_tokenizer import moses_tokenize
+
+            tokenize_text = moses_tokenize
+        if self.tokenizer and self.segmented:
+            from proc_gen.data.example_tokenizer import get_segment_tokenizer
+
+            tokenize = get_segment_tokenizer(self.tokenizer, self.cache_size)
+
+    @staticmethod
+    def tokenize_pieces(pieces: List[str]) -> List[str]:
+        """
+        Tokenizes the segments of `pieces`, or the joined pieces as a whole (one
+        piece) with full-string tokenization or if a segment can't be tokenized on
+        its own.
+        """
+        global tokenize, tokenize_text
+
+        tokenized = tokenize.tokenize_pieces(pieces) if tokenize else None
+        if tokenized is None:
+            tokenized = [tokenize_text(" ".join(pieces))]
+        return tokenized
+
+    @staticmethod
+    def encode_pieces(pieces: List[str]) -> str:
+        """
+        BPE-encodes the space-joined pieces by concatenating the encoding of each piece.
+
+        GPT-2 BPE never merges across the space in front of a word, so this equals
+        encoding the joined line, as long as no piece is empty or padded with spaces.
+        Otherwise, the (stripped) joined line is encoded as a whole.
+        """
+        global bpe, encode_piece
+
+        if any(not piece or piece != piece.strip() for piece in pieces):
+            return " ".join(map(str, bpe.encode(" ".join(pieces).strip())))
+
+        # Pieces after the first one are preceded by a space
+        return " ".join(
+            encode_piece(piece if i == 0 else " " + piece)
+            for i, piece in enumerate(pieces)
+        )
+
+    def encode(
+        self, fields_and_partition: Tuple[Dict[str, List[str]], str]
+    ) -> Tuple[str, List[Tuple[TranslationExample, TranslationExample]]]:
+        """
+        :return: (str) partition, and (tokenized example, BPE-encoded example) per
+            problem
+        """
+        global bpe, tokenize_text
+
+        fields, partition = fields_and_partition
+
+        # Tokenized and encoded segments are shared between all problems
+        examples = []
+        for problem in self.problems:
+            src_layout, tgt_layout = PROBLEM_TO_LAYOUT[problem]
+            src_pieces = layout_to_pieces(src_layout, fields)
+            tgt_pieces = layout_to_pieces(tgt_layout, fields)
+            if tokenize_text is not None:
+                src_pieces = self.tokenize_pieces(src_pieces)
+                tgt_pieces = self.tokenize_pieces(tgt_pieces)
+            example = TranslationExample(
+                src=" ".join(src_pieces), tgt=" ".join(tgt_pieces)
+            )
+            if bpe is not None:
+                bpe_example = TranslationExample(
+                    src=self.encode_pieces(src_pieces),
+                    tgt=self.encode_pieces(tgt_pieces),
+                )
+            else:
+                bpe_example = None
+            examples.append((example, bpe_example))
+
+        return partition, examples
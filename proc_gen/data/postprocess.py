@@ -0,0 +1,182 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import dataclasses
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from proc_gen import TASK_TO_PROBLEMS
+from proc_gen.data.codec import get_codec
+from proc_gen.data.example_tokenizer import get_segment_detokenizer
+from proc_gen.data.schema import Procedure
+from proc_gen.data.to_example import (
+    PROBLEM_TO_LAYOUT,
+    REQUIREMENTS,
+    TARGET_PRODUCT,
+    TASKS,
+    TranslationExample,
+)
+from proc_gen.problems import Problem
+
+__all__ = [
+    "STATUS_CODES",
+    "PredictionPostprocessor",
+    "read_generate_log",
+    "procedure_to_dict",
+]
+
+# Parse status of a sample, in order of the post-processing steps
+STATUS_CODES = [
+    "ok",
+    "empty",  # no hypothesis
+    "bpe_error",  # BPE ids that can't be decoded (or no BPE to decode them with)
+    "parse_error",  # doesn't have the layout of the problem (ValueError)
+    "invalid",  # parsed, but a field of the problem is empty
+]
+
+# (sample id, source, hypothesis) of one sample of a fairseq-generate log
+Sample = Tuple[int, str, str]
+# (sample id, status, procedure) of a post-processed sample
+Result = Tuple[int, str, Optional[Procedure]]
+
+
+def read_generate_log(lines: Iterable[str]) -> Iterator[Sample]:
+    """
+    Yields the samples of a fairseq-generate log from their S- and D- lines, in log
+    order. Only the first (best) hypothesis of each sample is kept.
+    """
+    sources = {}
+    seen = set()
+    for line in lines:
+        prefix, _, rest = line.partition("-")
+        if prefix not in ("S", "D") or not rest:
+            continue
+        fields = rest.rstrip("\n").split("\t")
+        _id = int(fields[0])
+        if prefix == "S":
+            sources[_id] = fields[1] if len(fields) > 1 else ""
+        elif _id not in seen:
+            # D-<id>, score, detokenized hypothesis
+            seen.add(_id)
+            yield _id, sources.pop(_id, ""), fields[2] if len(fields) > 2 else ""
+
+
+def procedure_to_dict(proc: Procedure) -> dict:
+    return dataclasses.asdict(proc)
+
+
+class PredictionPostprocessor(object):
+    """
+    Turns samples of a fairseq-generate log into procedures: decodes the BPE (if the
+    model was trained on BPE ids), detokenizes with Moses and parses the example
+    with the codec of the problem. Meant to be used as `multiprocessing.Pool` worker,
+    like `MultiprocessingEncoder`, with `process_batch` as mapped function.
+
+    Segments are detokenized through a bounded cache (see `SegmentTokenizer`), since
+    the same requirements and tasks recur across samples.
+
+    :param encoder_json: (str) GPT-2 BPE encoder, only needed for BPE id hypotheses
+    """
+
+    def __init__(
+        self,
+        problem: Problem,
+        tokenizer: Optional[str] = "moses",
+        encoder_json: str = None,
+        vocab_bpe: str = None,
+        cache_size: Optional[int] = 2 ** 20,
+    ):
+        if tokenizer not in (None, "moses"):
+            raise NotImplementedError("Only moses tokenizer currently supported.")
+        self.problem = problem
+        self.tokenizer = tokenizer
+        self.encoder_json = encoder_json
+        self.vocab_bpe = vocab_bpe
+        self.cache_size = cache_size
+        # Language modeling examples are a single sequence
+        self.single_sequence = problem in TASK_TO_PROBLEMS["language_modeling"]
+        self.fields = {
+            field
+            for layout in PROBLEM_TO_LAYOUT[problem]
+            for field in layout
+            if field in (TARGET_PRODUCT, REQUIREMENTS, TASKS)
+        }
+
+    def initializer(self):
+        global bpe, detokenize
+
+        bpe = None
+        if self.encoder_json:
+            from fairseq.data.encoders.gpt2_bpe import get_encoder
+
+            bpe = get_encoder(self.encoder_json, self.vocab_bpe)
+
+        detokenize = None
+        if self.tokenizer:
+            detokenize = get_segment_detokenizer(self.tokenizer, self.cache_size)
+
+    @staticmethod
+    def decode(text: str) -> str:
+        """BPE-decodes `text` if it consists of BPE ids, and detokenizes it."""
+        global bpe, detokenize
+
+        tokens = text.split()
+        if tokens and all(token.isdigit() for token in tokens):
+            if bpe is None:
+                raise KeyError("No BPE to decode ids with.")
+            text = bpe.decode(list(map(int, tokens)))
+        if detokenize is not None:
+            text = detokenize(text)
+        return text
+
+    def process(self, sample: Sample) -> Result:
+        _id, src, hypo = sample
+        if not hypo.strip():
+            return _id, "empty", None
+        try:
+            hypo = self.decode(hypo)
+            src = self.decode(src)
+        except (KeyError, ValueError):
+            return _id, "bpe_error", None
+
+        if self.single_sequence:
+            example = TranslationExample(src=hypo, tgt="")
+        else:
+            example = TranslationExample(src=src, tgt=hypo)
+        try:
+            proc = get_codec(self.problem).decode(example)
+        except ValueError:
+            return _id, "parse_error", None
+        if not self.is_complete(proc):
+            return _id, "invalid", None
+        return _id, "ok", proc
+
+    def is_complete(self, proc: Procedure) -> bool:
+        """:return: (bool) whether none of the fields of the problem are empty"""
+        reqs, tasks = proc.methods[0].requirements, proc.methods[0].tasks
+        if TARGET_PRODUCT in self.fields and not proc.target_product.strip():
+            return False
+        if REQUIREMENTS in self.fields and not (
+            reqs and all(req.object.strip() for req in reqs)
+        ):
+            return False
+        if TASKS in self.fields and not (tasks and all(t.strip() for t in tasks)):
+            return False
+        return True
+
+    def process_batch(self, samples: List[Sample]) -> List[Result]:
+        return [self.process(sample) for sample in samples]
@@ -0,0 +1,206 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import json
+import shutil
+from array import array
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Tuple, Union
+
+import numpy as np
+
+from proc_gen.data.batch import (
+    STRING_COLUMNS,
+    ProcedureBatch,
+    ProcedureBatchBuilder,
+    ProcedureView,
+    StringColumn,
+)
+from proc_gen.data.schema import Procedure, PARTITIONS
+
+__all__ = ["ProcedureStore", "ProcedureStoreWriter", "build_procedure_store"]
+
+STORE_VERSION = 1
+OFFSET_ARRAYS = ["method_offsets", "requirement_offsets", "task_offsets"]
+
+
+class _FileStringColumnBuilder:
+    """`StringColumnBuilder` that streams the utf-8 buffer to disk."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = open(path, "wb")
+        self.size = 0
+        self.offsets = array("q", [0])
+
+    def append(self, string: str):
+        encoded = string.encode("utf-8")
+        self.file.write(encoded)
+        self.size += len(encoded)
+        self.offsets.append(self.size)
+
+    def close(self):
+        self.file.close()
+
+
+class ProcedureStoreWriter:
+    """Writes parsed procedures and their partition to an on-disk `ProcedureStore`.
+
+    Layout of the store directory:
+        <column>.bin, <column>.offsets.npy  flat utf-8 buffer and offsets per string
+                                            column of a `ProcedureBatch`
+        <name>_offsets.npy                  procedure/method nesting
+        requirement_optional.npy            tri-state optional flag per requirement
+        partitions.npy                      index into PARTITIONS per procedure
+        meta.json                           store version, size and user metadata
+
+    The store is written to <path>.partial and only moved to `path` by `close()`, so
+    a store interrupted by an error is never read as a complete one.
+    """
+
+    def __init__(self, path: Union[str, Path], meta: dict = None):
+        self.final_path = Path(path)
+        if self.final_path.exists():
+            raise FileExistsError(f"Procedure store {self.final_path} exists.")
+        self.path = self.final_path.with_name(f"{self.final_path.name}.partial")
+        # Left behind by a killed process
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.path.mkdir(parents=True)
+        self.meta = meta or {}
+        self._columns = {}
+        self._builder = ProcedureBatchBuilder(column_builder=self._column_builder)
+        self._partitions = array("b")
+
+    def _column_builder(self, name: str) -> _FileStringColumnBuilder:
+        column = _FileStringColumnBuilder(self.path / f"{name}.bin")
+        self._columns[name] = column
+        return column
+
+    def add(self, proc: Procedure, partition: str):
+        self._builder.append(proc)
+        self._partitions.append(PARTITIONS.index(partition))
+
+    def close(self):
+        for name, column in self._columns.items():
+            column.close()
+            np.save(self.path / f"{name}.offsets.npy", np.asarray(column.offsets))
+        for name in OFFSET_ARRAYS:
+            np.save(self.path / f"{name}.npy", np.asarray(getattr(self._builder, name)))
+        np.save(
+            self.path / "requirement_optional.npy",
+            np.asarray(self._builder.requirement_optional, dtype=np.int8),
+        )
+        np.save(self.path / "partitions.npy", np.asarray(self._partitions, np.int8))
+
+        meta = dict(self.meta, version=STORE_VERSION, size=len(self._partitions))
+        with open(self.path / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+        self.path.rename(self.final_path)
+
+    def abort(self):
+        """Discards the partially written store."""
+        for column in self._columns.values():
+            column.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ProcedureStore:
+    """Memory-mapped, read-only store of parsed procedures with partition labels.
+
+    Supports random access (`store[i]` -> (ProcedureView, partition)) and sequential
+    scans (`store.scan()`), without loading the store in memory.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path / "meta.json", "r") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != STORE_VERSION:
+            raise ValueError(
+                f"Procedure store {self.path} has version {self.meta['version']}, "
+                f"expected {STORE_VERSION}. Rebuild the store."
+            )
+
+        columns = {name: self._load_column(name) for name in STRING_COLUMNS}
+        offsets = {name: self._load_array(name) for name in OFFSET_ARRAYS}
+        self.batch = ProcedureBatch(
+            requirement_optional=self._load_array("requirement_optional"),
+            **columns,
+            **offsets,
+        )
+        self.partitions = self._load_array("partitions")
+
+    def _load_array(self, name: str) -> np.ndarray:
+        return np.load(self.path / f"{name}.npy", mmap_mode="r")
+
+    def _load_column(self, name: str) -> StringColumn:
+        data_path = self.path / f"{name}.bin"
+        if data_path.stat().st_size == 0:
+            # Empty files can't be memory-mapped
+            data = np.empty(0, dtype=np.uint8)
+        else:
+            data = np.memmap(data_path, dtype=np.uint8, mode="r")
+
+        return StringColumn(data, self._load_array(f"{name}.offsets"))
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def __getitem__(self, index: int) -> Tuple[ProcedureView, str]:
+        return self.batch[index], PARTITIONS[self.partitions[index]]
+
+    def indices(self, partition: str) -> np.ndarray:
+        return np.flatnonzero(self.partitions == PARTITIONS.index(partition))
+
+    def scan(self, partition: str = None) -> Iterator[Tuple[ProcedureView, str]]:
+        """Yields (procedure, partition) tuples in store order."""
+        if partition is None:
+            for view, part in zip(self.batch, self.partitions):
+                yield view, PARTITIONS[part]
+        else:
+            for i in self.indices(partition):
+                yield self.batch[i], partition
+
+
+def build_procedure_store(
+    path: Union[str, Path],
+    entries: Iterable,
+    parse_procedure: Callable,
+    meta: dict = None,
+) -> ProcedureStore:
+    """Parses dataset entries once and writes the resulting procedures to a store.
+
+    :param entries: (Iterable) raw dataset entries, e.g. from a dataset loader
+    :param parse_procedure: (Callable) parses an entry to a (Procedure, partition) tuple
+    :param meta: (dict) additional metadata to store, e.g. the dataset name
+    """
+    with ProcedureStoreWriter(path, meta=meta) as writer:
+        for entry in entries:
+            proc, partition = parse_procedure(entry)
+            writer.add(proc, partition)
+
+    return ProcedureStore(path)
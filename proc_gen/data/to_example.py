@@ -17,8 +17,9 @@
 # IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from dataclasses import dataclass
-from typing import Iterable, List, Union
+from typing import Dict, Iterable, List, Sequence, Union
 
+from proc_gen.data.batch import ProcedureBatch, ProcedureView
 from proc_gen.data.schema import Procedure, Requirement, Method
 from proc_gen.problems import Problem
 
@@ -30,6 +31,10 @@ __all__ = [
     "string_to_requirements",
     "string_to_tasks",
     "example_to_procedure",
+    "PROBLEM_TO_LAYOUT",
+    "procedure_to_fields",
+    "layout_to_pieces",
+    "fields_to_example",
 ]
 
 TARGET_PRODUCT_SEP = "<tps>"
@@ -45,6 +50,48 @@ SPECIAL_TOKENS = [
 ]
 
 
+# Fields of a procedure that make up an example
+TARGET_PRODUCT = "target_product"
+REQUIREMENTS = "requirements"
+TASKS = "tasks"
+FIELD_TO_SEP = {REQUIREMENTS: REQUIREMENT_SEP, TASKS: TASK_SEP}
+
+# Sequence of fields and separators on the (src, tgt) side of an example, per problem
+PROBLEM_TO_LAYOUT = {
+    Problem.Requirements_TO_TargetProductAndTasks: (
+        (REQUIREMENTS,),
+        (TARGET_PRODUCT, TARGET_PRODUCT_SEP, TASKS),
+    ),
+    Problem.RequirementsAndTargetProductAndTasks: (
+        (
+            REQUIREMENTS,
+            REQUIREMENTS_TP_SEP,
+            TARGET_PRODUCT,
+            TARGET_PRODUCT_SEP,
+            TASKS,
+        ),
+        (),
+    ),
+    Problem.TargetProductAndRequirements_TO_Tasks: (
+        (REQUIREMENTS, TARGET_PRODUCT_SEP, TARGET_PRODUCT),
+        (TASKS,),
+    ),
+    Problem.TargetProductAndRequirementsAndTasks: (
+        (
+            TARGET_PRODUCT,
+            TARGET_PRODUCT_SEP,
+            REQUIREMENTS,
+            REQUIREMENTS_TASKS_SEP,
+            TASKS,
+        ),
+        (),
+    ),
+    Problem.Requirements_TO_TargetProduct: ((REQUIREMENTS,), (TARGET_PRODUCT,)),
+    Problem.TargetProduct_TO_Requirements: ((TARGET_PRODUCT,), (REQUIREMENTS,)),
+    Problem.Tasks_TO_TargetProduct: ((TASKS,), (TARGET_PRODUCT,)),
+}
+
+
 @dataclass
 class TranslationExample:
     src: str
@@ -93,7 +140,17 @@ def string_to_requirements(
         return [Requirement.from_string(req_str) for req_str in req_strings]
 
 
-def procedure_to_example(proc: Procedure, problem: str) -> TranslationExample:
+def procedure_to_example(
+    proc: Union[Procedure, ProcedureView, ProcedureBatch], problem: str
+) -> Union[TranslationExample, List[TranslationExample]]:
+    """Converts a procedure to a translation example for the given problem.
+
+    :param proc: (Procedure) procedure or view on a procedure, or (ProcedureBatch) a
+        batch of procedures, in which case a list of examples is returned.
+    """
+    if isinstance(proc, ProcedureBatch):
+        return [procedure_to_example(view, problem) for view in proc]
+
     assert len(proc.methods) > 0, (
         f"Procedure {proc} didn't contain any methods. "
         f"Cannot convert to translation example."
@@ -173,3 +230,61 @@ def example_to_procedure(example: TranslationExample, problem: str) -> Procedure
     assert proc.methods[0].requirements and proc.methods[0].tasks
 
     return proc
+
+
+def procedure_to_fields(proc: Procedure) -> Dict[str, List[str]]:
+    """Splits a procedure into the segments of each field in its example layouts."""
+    method = proc.methods[0]
+
+    return {
+        TARGET_PRODUCT: [proc.target_product],
+        REQUIREMENTS: [req.to_string() for req in method.requirements],
+        TASKS: list(method.tasks),
+    }
+
+
+def layout_to_pieces(layout: Sequence[str], fields: Dict[str, List[str]]) -> List[str]:
+    """
+    Lists the segments and separators that, joined by single spaces, make up one side
+    of an example. Equivalent to the string building in `procedure_to_example`.
+    """
+    if TARGET_PRODUCT in layout and not fields[TARGET_PRODUCT][0]:
+        # An empty target product is left out, together with its separator
+        tp_index = layout.index(TARGET_PRODUCT)
+        if tp_index + 1 < len(layout) and layout[tp_index + 1] == TARGET_PRODUCT_SEP:
+            sep_index = tp_index + 1
+        else:
+            sep_index = tp_index - 1
+        layout = [
+            item
+            for i, item in enumerate(layout)
+            if i != tp_index and i != sep_index
+        ]
+
+    pieces = []
+    for item in layout:
+        if item in SPECIAL_TOKENS:
+            pieces.append(item)
+            continue
+
+        # An empty field is joined as an empty segment
+        segments = fields[item] or [""]
+        pieces.append(segments[0])
+        for segment in segments[1:]:
+            pieces.append(FIELD_TO_SEP[item])
+            pieces.append(segment)
+
+    return pieces
+
+
+def fields_to_example(
+    fields: Dict[str, List[str]], problem: Problem
+) -> TranslationExample:
+    if problem not in PROBLEM_TO_LAYOUT:
+        raise NotImplementedError(f"No example layout for problem {problem}.")
+    src_layout, tgt_layout = PROBLEM_TO_LAYOUT[problem]
+
+    return TranslationExample(
+        src=" ".join(layout_to_pieces(src_layout, fields)),
+        tgt=" ".join(layout_to_pieces(tgt_layout, fields)),
+    )
@@ -25,6 +25,7 @@ import pandas as pd
 
 from proc_gen.data import string_to_requirements
 from proc_gen.data.to_example import string_to_tasks
+from proc_gen.evaluate.similarity import get_similarity
 from vizseq.scorers import VizSeqScorer, VizSeqScore, register_scorer
 
 
@@ -32,12 +33,6 @@ class ScoreComputationError(ValueError):
     pass
 
 
-#
-# # from vizseq.scorers.bert_score import BERTScoreScorer
-#
-bert_scorer = None
-
-
 from collections import namedtuple
 
 Req = namedtuple("Req", ["object", "optional"])
@@ -162,36 +157,17 @@ class EssentialRequirementCoverageScorer(VizSeqScorer):
         )
 
 
-def _best_match(tasks_gt, t):
-    global bert_scorer
-
-    if not bert_scorer:
-        import bert_score as bs
-
-        print("Loading BERTScorer")
-        bert_scorer = bs.BERTScorer(
-            model_type="distilbert-base-uncased-distilled-squad",
-            nthreads=1,
-            lang="en",
-            rescale_with_baseline=True,
-        )
-        print("Done loading BERTScorer")
-
-    assert t and len(tasks_gt)
-    t = t.lower()
-    tasks_gt = [task.lower() for task in tasks_gt]
-    all_scores = bert_scorer.score(
-        list(map(lambda s: s.lower(), tasks_gt)),
-        [t.lower() for _ in range(len(tasks_gt))],
-        verbose=True,
-    )[2].tolist()
-    best_match_index = np.argmax(all_scores)
+def _best_matches(tasks_gt, tasks_pred, similarity="bert_score"):
+    assert tasks_pred and len(tasks_gt)
+    best_match_indices = get_similarity(similarity).best_matches(
+        [t.lower() for t in tasks_pred], [task.lower() for task in tasks_gt]
+    )
 
-    # Return one-based index
-    return best_match_index + 1
+    # Return one-based indices
+    return [int(i) + 1 for i in best_match_indices]
 
 
-def compute_task_order_score(tasks_gt, tasks_pred):
+def compute_task_order_score(tasks_gt, tasks_pred, similarity="bert_score"):
     # TODO: test this function
     if len(tasks_pred) < len(tasks_gt):
         # TODO: Happens around 3/4 of the time, should implement this case.
@@ -205,12 +181,12 @@ def compute_task_order_score(tasks_gt, tasks_pred):
     # Get ranks for pred
     # account for
     #   1) pred tasks being somewhat different from gt
-    #       -> best match based on embedding distance (bert score)
+    #       -> best match based on similarity (bert score, or char n-grams)
     #   2.1) ground truth task comprising multiple predicted tasks
     #       -> Kendall Tau allows ties
     # TODO: not yet accounted for
     #   2.2) predicted task comprising multiple ground truth tasks
-    ranks_pred = [_best_match(tasks_gt, t) for t in tasks_pred[: len(ranks_gt)]]
+    ranks_pred = _best_matches(tasks_gt, tasks_pred[: len(ranks_gt)], similarity)
     # assert ranks are not constant
     if len(set(ranks_pred)) == 1:
         raise ScoreComputationError(
@@ -235,8 +211,9 @@ class KendallTaskRankingScorer(VizSeqScorer):
         tags: Optional[List[List[str]]] = None,
         sources: Optional[List[List[str]]] = None,
     ) -> VizSeqScore:
-        # global bert_scorer
         problem = self.extra_args["problem"]
+        # Backend in proc_gen.evaluate.similarity.SIMILARITY_BACKENDS
+        similarity = self.extra_args.get("similarity", "bert_score")
 
         # Only relevant if predicting tasks
         assert problem in (
@@ -278,7 +255,7 @@ class KendallTaskRankingScorer(VizSeqScorer):
                 tasks_pred = string_to_tasks(hypo)
 
             try:
-                score = compute_task_order_score(tasks_gt, tasks_pred)
+                score = compute_task_order_score(tasks_gt, tasks_pred, similarity)
                 sent_scores.append(score)
             except ScoreComputationError:
                 continue
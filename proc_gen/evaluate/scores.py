@@ -1,14 +1,25 @@
+import inspect
 import sys
+import time
 from typing import Optional, List, Dict, Tuple
 
 import logging
 
+import numpy as np
+
 from vizseq._data import (
     PathOrPathsOrDictOfStrList,
     VizSeqDataSources,
     VizSeqTableExporter,
 )
-from vizseq.scorers import get_scorer_ids, get_scorer, get_scorer_name
+from vizseq.scorers import (
+    VizSeqScore,
+    get_scorer_ids,
+    get_scorer,
+    get_scorer_name,
+)
+
+from proc_gen import tracing
 
 __all__ = ["get_scores", "scores_to_latex"]
 
@@ -16,6 +27,19 @@ logger = logging.getLogger("scores")
 logger.addHandler(logging.StreamHandler(sys.stdout))
 logger.setLevel(logging.INFO)
 
+# Scorers of proc_gen.evaluate.scorers, which need the problem (and sources)
+PROC_GEN_SCORERS = (
+    "kendall_task_ranking",
+    "req_cov",
+    "essential_req_cov",
+    "achievement",
+    "granularity",
+)
+
+# Scorers that (re)load a model on every score() call, and whose corpus score is the
+# mean of the sentence scores. These score the hypotheses of all models in one call.
+MODEL_BATCHED_SCORERS = ("bert_score",)
+
 
 def get_scores(
     sources: PathOrPathsOrDictOfStrList,
@@ -25,7 +49,15 @@ def get_scores(
     tags: Optional[PathOrPathsOrDictOfStrList] = None,
     verbose: bool = False,
     problem: str = None,
+    timings: Optional[Dict] = None,
+    similarity: str = "bert_score",
 ) -> Tuple[Dict, Dict]:
+    """
+    :param similarity: (str) similarity backend with which the Kendall task ranking
+        scorer aligns predicted and ground truth tasks (see SIMILARITY_BACKENDS)
+    :param timings: (dict) if provided, filled with the seconds spent per metric and
+        model. Time of a scorer that scores all models in one call is split evenly.
+    """
     # Copyright (c) Facebook, Inc. and its affiliates.
     # The code in this function is licensed under the MIT license.
     _srcs = VizSeqDataSources(sources)
@@ -45,28 +77,52 @@ def get_scores(
         else:
             logger.warning(f'"{s}" is not a valid metric.')
 
-    def scorer_kwargs(s):
-        kwargs = {"corpus_level": True, "sent_level": False, "verbose": verbose}
-        if s in (
-            "kendall_task_ranking",
-            "req_cov",
-            "essential_req_cov",
-            "achievement",
-            "granularity",
-        ):
+    def scorer_kwargs(s, sent_level=False):
+        kwargs = {"corpus_level": True, "sent_level": sent_level, "verbose": verbose}
+        if s in PROC_GEN_SCORERS:
             # ProcGenScorer's
-            kwargs["extra_args"] = {"problem": problem}
+            kwargs["extra_args"] = {"problem": problem, "similarity": similarity}
         return kwargs
 
-    scores = {
-        s: {
-            m: get_scorer(s)(**scorer_kwargs(s)).score(
-                _hypos.data[i].text, _refs.text, tags=_tags, sources=_srcs.text
-            )
-            for i, m in enumerate(models)
-        }
-        for s in _metrics
-    }
+    def score(s, hypotheses, references, tags, sent_level=False):
+        scorer = get_scorer(s)(**scorer_kwargs(s, sent_level))
+        kwargs = {"tags": tags}
+        # Only proc_gen's scorers look at the sources
+        if "sources" in inspect.signature(scorer.score).parameters:
+            kwargs["sources"] = _srcs.text
+        return scorer.score(hypotheses, references, **kwargs)
+
+    scores = {s: {} for s in _metrics}
+    for s in _metrics:
+        if s in MODEL_BATCHED_SCORERS and len(models) > 1 and _tags is None:
+            start = time.perf_counter()
+            n = len(_refs.text[0])
+            # One scorer call (and model load) for all models
+            with tracing.span(f"evaluate/score/{s}", models=list(models)):
+                batched = score(
+                    s,
+                    [h for i in range(len(models)) for h in _hypos.data[i].text],
+                    [r * len(models) for r in _refs.text],
+                    None,
+                    sent_level=True,
+                )
+            for i, m in enumerate(models):
+                sent_scores = batched.sent_scores[i * n : (i + 1) * n]
+                scores[s][m] = VizSeqScore.make(
+                    corpus_score=np.mean(sent_scores),
+                    sent_scores=None,
+                    group_scores=None,
+                )
+            if timings is not None:
+                elapsed = time.perf_counter() - start
+                timings[s] = {m: elapsed / len(models) for m in models}
+            continue
+        for i, m in enumerate(models):
+            start = time.perf_counter()
+            with tracing.span(f"evaluate/score/{s}", models=[m]):
+                scores[s][m] = score(s, _hypos.data[i].text, _refs.text, _tags)
+            if timings is not None:
+                timings.setdefault(s, {})[m] = time.perf_counter() - start
 
     corpus_scores = {
         s: {m: scores[s][m].corpus_score for m in models} for s in _metrics
@@ -0,0 +1,135 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Similarity backends of the Kendall task ranking scorer, which aligns every predicted
+task with its best matching ground truth task.
+"""
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+__all__ = [
+    "SimilarityBackend",
+    "BERTScoreSimilarity",
+    "CharNgramSimilarity",
+    "SIMILARITY_BACKENDS",
+    "get_similarity",
+]
+
+
+class SimilarityBackend:
+    """Scores the similarity of every (query, candidate) pair of texts."""
+
+    def similarities(self, queries: List[str], candidates: List[str]) -> np.ndarray:
+        """:return: (np.ndarray) similarities, (len(queries), len(candidates))"""
+        raise NotImplementedError
+
+    def best_matches(self, queries: List[str], candidates: List[str]) -> np.ndarray:
+        """:return: (np.ndarray) index of the most similar candidate of each query"""
+        return self.similarities(queries, candidates).argmax(axis=1)
+
+
+class BERTScoreSimilarity(SimilarityBackend):
+    """BERTScore F1 (rescaled with baseline) of a distilled BERT model."""
+
+    def __init__(
+        self, model_type: str = "distilbert-base-uncased-distilled-squad", nthreads=1
+    ):
+        self.model_type = model_type
+        self.nthreads = nthreads
+        self._scorer = None
+
+    @property
+    def scorer(self):
+        if self._scorer is None:
+            import bert_score as bs
+
+            print("Loading BERTScorer")
+            self._scorer = bs.BERTScorer(
+                model_type=self.model_type,
+                nthreads=self.nthreads,
+                lang="en",
+                rescale_with_baseline=True,
+            )
+            print("Done loading BERTScorer")
+        return self._scorer
+
+    def similarities(self, queries: List[str], candidates: List[str]) -> np.ndarray:
+        # All pairs in one call, rather than one call per query
+        scores = self.scorer.score(
+            [c for _ in queries for c in candidates],
+            [q for q in queries for _ in candidates],
+            verbose=False,
+        )[2].tolist()
+        return np.asarray(scores).reshape(len(queries), len(candidates))
+
+
+class CharNgramSimilarity(SimilarityBackend):
+    """
+    Cosine similarity of TF-IDF weighted character n-gram counts. The document
+    frequencies are those of the texts being compared, so n-grams that all tasks
+    of a procedure share weigh less.
+    """
+
+    def __init__(self, ngram_range: Tuple[int, int] = (2, 4)):
+        self.ngram_range = ngram_range
+
+    def _ngrams(self, text: str) -> Counter:
+        # Pad words, so n-grams at word boundaries differ from those inside words
+        text = f" {' '.join(text.split())} "
+        min_n, max_n = self.ngram_range
+        return Counter(
+            text[i : i + n]
+            for n in range(min_n, max_n + 1)
+            for i in range(len(text) - n + 1)
+        )
+
+    def similarities(self, queries: List[str], candidates: List[str]) -> np.ndarray:
+        counts = [self._ngrams(text) for text in queries + candidates]
+        vocabulary: Dict[str, int] = {}
+        for c in counts:
+            for ngram in c:
+                vocabulary.setdefault(ngram, len(vocabulary))
+
+        tf = np.zeros((len(counts), len(vocabulary)))
+        for row, c in enumerate(counts):
+            tf[row, [vocabulary[ngram] for ngram in c]] = list(c.values())
+        # Smoothed inverse document frequency
+        df = (tf > 0).sum(axis=0)
+        tfidf = tf * (np.log((1 + len(counts)) / (1 + df)) + 1)
+        norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+        tfidf /= np.where(norms > 0, norms, 1)
+
+        return tfidf[: len(queries)] @ tfidf[len(queries) :].T
+
+
+SIMILARITY_BACKENDS = {
+    "bert_score": BERTScoreSimilarity,
+    "char_ngram": CharNgramSimilarity,
+}
+
+_backends: Dict[str, SimilarityBackend] = {}
+
+
+def get_similarity(name: str) -> SimilarityBackend:
+    """:return: the (shared) backend registered as `name` in SIMILARITY_BACKENDS"""
+    if name not in _backends:
+        _backends[name] = SIMILARITY_BACKENDS[name]()
+    return _backends[name]
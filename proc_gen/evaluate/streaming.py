@@ -0,0 +1,455 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Streaming evaluation: scores fairseq generation logs while they are being written.
+"""
+import inspect
+import logging
+import math
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from vizseq.scorers import get_scorer, get_scorer_ids
+
+from proc_gen import tracing
+from proc_gen.evaluate.scores import PROC_GEN_SCORERS
+
+__all__ = [
+    "RunningStats",
+    "CorpusStatistics",
+    "BLEUStatistics",
+    "ChrFStatistics",
+    "WERStatistics",
+    "MeanStatistics",
+    "get_corpus_statistics",
+    "follow_lines",
+    "GenerateLogSamples",
+    "BERTScoreSentences",
+    "StreamingEvaluator",
+]
+
+logger = logging.getLogger("streaming")
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.propagate = False
+logger.setLevel(logging.INFO)
+
+# Last line fairseq-generate writes to its results file
+_GENERATE_DONE_PREFIX = "Generate "
+
+
+class RunningStats:
+    """Mean and variance of a stream of values (Welford's algorithm)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, value: float):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    def ci(self, z: float = 1.96) -> float:
+        """Half width of the normal-approximation confidence interval of the mean."""
+        return z * math.sqrt(self.variance / self.n) if self.n else math.inf
+
+    def to_dict(self) -> Dict:
+        return {"n": self.n, "mean": self.mean, "std": math.sqrt(self.variance)}
+
+
+class CorpusStatistics:
+    """
+    Sufficient statistics of the corpus score of a metric, summed over batches of
+    samples, so that the corpus score of a stream equals the one of scoring all
+    samples at once (as pg-evaluate-model does with vizseq's scorers).
+    """
+
+    def update(
+        self, hypotheses: List[str], references: List[str], sent_scores: List[float]
+    ):
+        raise NotImplementedError
+
+    def score(self) -> float:
+        raise NotImplementedError
+
+
+class BLEUStatistics(CorpusStatistics):
+    """N-gram matches, n-gram counts and lengths of corpus BLEU (vizseq's bleu)."""
+
+    def __init__(self):
+        from sacrebleu.metrics import BLEU
+        from vizseq.scorers.bleu import get_default_args
+
+        self._bleu = BLEU(get_default_args(tokenize="none"))
+        self.correct = [0] * BLEU.NGRAM_ORDER
+        self.total = [0] * BLEU.NGRAM_ORDER
+        self.sys_len = 0
+        self.ref_len = 0
+
+    def update(
+        self, hypotheses: List[str], references: List[str], sent_scores: List[float]
+    ):
+        batch = self._bleu.corpus_score(
+            hypotheses, [references], use_effective_order=False
+        )
+        for n in range(len(self.correct)):
+            self.correct[n] += batch.counts[n]
+            self.total[n] += batch.totals[n]
+        self.sys_len += batch.sys_len
+        self.ref_len += batch.ref_len
+
+    def score(self) -> float:
+        return self._bleu.compute_bleu(
+            list(self.correct),
+            list(self.total),
+            self.sys_len,
+            self.ref_len,
+            smooth_method="exp",
+        ).score
+
+
+class ChrFStatistics(CorpusStatistics):
+    """Character n-gram statistics of corpus chrF (vizseq's chrf)."""
+
+    def __init__(self):
+        from sacrebleu.metrics import CHRF
+        from vizseq.scorers.chrf import get_default_args
+
+        self._chrf = CHRF(get_default_args())
+        self.statistics = [0] * (self._chrf.order * 3)
+
+    def update(
+        self, hypotheses: List[str], references: List[str], sent_scores: List[float]
+    ):
+        for hypothesis, reference in zip(hypotheses, references):
+            sentence = self._chrf.get_sentence_statistics(hypothesis, [reference])
+            for i, value in enumerate(sentence):
+                self.statistics[i] += value
+
+    def score(self) -> float:
+        return self._chrf.compute_chrf(
+            self.statistics, self._chrf.order, self._chrf.beta
+        ).score
+
+
+class WERStatistics(CorpusStatistics):
+    """Edits and reference length of corpus WER (vizseq's wer)."""
+
+    def __init__(self):
+        # Sentence WER (percent) times reference length
+        self.edits = 0.0
+        self.ref_len = 0
+
+    def update(
+        self, hypotheses: List[str], references: List[str], sent_scores: List[float]
+    ):
+        for reference, wer in zip(references, sent_scores):
+            self.edits += wer * len(reference.split())
+            self.ref_len += len(reference.split())
+
+    def score(self) -> float:
+        return self.edits / self.ref_len if self.ref_len else math.nan
+
+
+class MeanStatistics(CorpusStatistics):
+    """
+    Sum of the sentence scores of metrics whose corpus score is their mean, times
+    `scale`.
+    """
+
+    def __init__(self, scale: float = 1.0):
+        self.scale = scale
+        self.total = 0.0
+        self.n = 0
+
+    def update(
+        self, hypotheses: List[str], references: List[str], sent_scores: List[float]
+    ):
+        self.total += sum(sent_scores)
+        self.n += len(sent_scores)
+
+    def score(self) -> float:
+        return self.scale * self.total / self.n if self.n else math.nan
+
+
+def get_corpus_statistics(metric: str) -> CorpusStatistics:
+    """:return: (CorpusStatistics) empty statistics of `metric`"""
+    if metric == "bleu":
+        return BLEUStatistics()
+    if metric == "chrf":
+        return ChrFStatistics()
+    if metric == "wer":
+        return WERStatistics()
+    if metric in ("req_cov", "essential_req_cov"):
+        # Sentence scores are fractions, corpus scores percentages
+        return MeanStatistics(scale=100.0)
+    return MeanStatistics()
+
+
+def follow_lines(
+    paths: List[Union[str, Path]], poll_interval: float = 1.0, idle_timeout=None
+) -> Iterator[Tuple[int, str]]:
+    """
+    Yields (index of the path, line) for the complete lines of `paths` as they are
+    written, like `tail -f`. Files that don't exist yet are waited for. Stops when
+    every file ends with fairseq-generate's final line, or when no file grew for
+    `idle_timeout` seconds.
+    """
+    handles = [None] * len(paths)
+    partial = [""] * len(paths)
+    done = [False] * len(paths)
+    last_growth = time.time()
+
+    try:
+        while not all(done):
+            grew = False
+            for i, path in enumerate(paths):
+                if done[i]:
+                    continue
+                if handles[i] is None:
+                    if not os.path.exists(path):
+                        continue
+                    handles[i] = open(path, "r", encoding="utf-8")
+
+                for chunk in iter(handles[i].readline, ""):
+                    grew = True
+                    if not chunk.endswith("\n"):
+                        # Incomplete line, the rest is still being written
+                        partial[i] += chunk
+                        continue
+                    line, partial[i] = partial[i] + chunk, ""
+                    if line.startswith(_GENERATE_DONE_PREFIX):
+                        done[i] = True
+                    yield i, line.rstrip("\n")
+
+            if grew:
+                last_growth = time.time()
+            elif idle_timeout is not None and time.time() - last_growth > idle_timeout:
+                logger.warning(
+                    f"No new generations for {idle_timeout} seconds, stopping."
+                )
+                return
+            else:
+                time.sleep(poll_interval)
+    finally:
+        for handle in handles:
+            if handle is not None:
+                handle.close()
+
+
+class GenerateLogSamples:
+    """
+    Assembles the (source, reference, hypothesis) samples of fairseq-generate logs
+    from their S-, T- and D- lines, as lines arrive.
+
+    :param language_modeling: (bool) whether the T- and D- lines are language modeling
+        examples ("<prompt> <rts> <continuation>"), of which the continuation is
+        scored, like pg-evaluate-model does
+    """
+
+    def __init__(self, language_modeling: bool = False):
+        self.language_modeling = language_modeling
+        self._pending: Dict[Tuple[int, str], Dict[str, str]] = {}
+
+    def add_line(self, log_index: int, line: str) -> Optional[Tuple[str, str, str]]:
+        """:return: the sample `line` completes, if any"""
+        prefix, _, rest = line.partition("-")
+        if prefix not in ("S", "T", "D") or not rest:
+            return None
+        fields = rest.split("\t")
+        if prefix == "D":
+            # D-<id>, score, detokenized hypothesis
+            _id, sent = fields[0], fields[2] if len(fields) > 2 else ""
+        else:
+            _id, sent = fields[0], fields[1] if len(fields) > 1 else ""
+
+        key = (log_index, _id)
+        sample = self._pending.setdefault(key, {})
+        # Only the first (best) hypothesis of each sample is scored
+        sample.setdefault(prefix, sent)
+        if len(sample) < 3:
+            return None
+        del self._pending[key]
+        if self.language_modeling:
+            source, reference = sample["T"].split(" <rts> ")[:2]
+            return source, reference, sample["D"].split(" <rts> ")[1]
+        return sample["S"], sample["T"], sample["D"]
+
+
+class BERTScoreSentences:
+    """
+    Sentence BERTScore F1 like vizseq's bert_score scorer (default model of the
+    language of the first reference), which loads the model on every call. Here,
+    one `bert_score.BERTScorer` is loaded at the first call and kept.
+    """
+
+    def __init__(self):
+        self._scorer = None
+
+    def score(self, hypotheses: List[str], references: List[str]) -> List[float]:
+        if self._scorer is None:
+            import bert_score as bs
+            import langid
+
+            lang = langid.classify(references[0])[0]
+            logger.info(f"Loading BERTScorer ({lang})")
+            self._scorer = bs.BERTScorer(lang=lang)
+        return self._scorer.score(hypotheses, references, verbose=False)[2].tolist()
+
+
+class StreamingEvaluator:
+    """
+    Scores samples at sentence level, in batches of `batch_size`, and keeps running
+    corpus scores, from statistics summed over the batches (see `CorpusStatistics`),
+    which equal the ones of scoring all samples at once. The mean of the sentence
+    scores, with a confidence interval, is kept as well.
+    """
+
+    def __init__(
+        self,
+        metrics: List[str],
+        problem: str = None,
+        batch_size: int = 64,
+        similarity: str = "bert_score",
+    ):
+        self.batch_size = batch_size
+        self.scorers = {}
+        for metric in metrics:
+            if metric not in get_scorer_ids():
+                logger.warning(f'"{metric}" is not a valid metric.')
+                continue
+            if metric == "bert_score":
+                self.scorers[metric] = BERTScoreSentences()
+                continue
+            extra_args = (
+                {"problem": problem, "similarity": similarity}
+                if metric in PROC_GEN_SCORERS
+                else None
+            )
+            self.scorers[metric] = get_scorer(metric)(
+                corpus_level=False, sent_level=True, extra_args=extra_args
+            )
+        self.stats = {metric: RunningStats() for metric in self.scorers}
+        self.corpus_stats = {
+            metric: get_corpus_statistics(metric) for metric in self.scorers
+        }
+        self.num_samples = 0
+        self._batch: List[Tuple[str, str, str]] = []
+
+    def add(self, source: str, reference: str, hypothesis: str):
+        self._batch.append((source, reference, hypothesis))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def add_all(self, samples: Iterable[Tuple[str, str, str]]):
+        for sample in samples:
+            self.add(*sample)
+        self.flush()
+
+    def sentence_scores(
+        self,
+        metric: str,
+        sources: List[str],
+        references: List[str],
+        hypotheses: List[str],
+    ) -> List[float]:
+        scorer = self.scorers[metric]
+        if isinstance(scorer, BERTScoreSentences):
+            return scorer.score(hypotheses, references)
+        kwargs = {}
+        if "sources" in inspect.signature(scorer.score).parameters:
+            kwargs["sources"] = [sources]
+        result = scorer.score(hypotheses, [references], **kwargs)
+        return [float(score) for score in result.sent_scores or []]
+
+    def flush(self):
+        """Scores the buffered samples."""
+        if not self._batch:
+            return
+        sources, references, hypotheses = map(list, zip(*self._batch))
+        for metric in self.scorers:
+            with tracing.span(f"evaluate/score/{metric}", samples=len(hypotheses)):
+                scores = self.sentence_scores(metric, sources, references, hypotheses)
+                self.corpus_stats[metric].update(hypotheses, references, scores)
+            for score in scores:
+                self.stats[metric].update(score)
+        self.num_samples += len(self._batch)
+        self._batch = []
+
+    def summary(self, z: float = 1.96) -> Dict[str, Dict]:
+        """
+        Per metric: the running corpus score, and the mean, standard deviation and
+        CI half width of the sentence scores.
+        """
+        return {
+            metric: {
+                "n": stats.n,
+                "corpus_score": self.corpus_stats[metric].score(),
+                "sentence_mean": stats.mean,
+                "sentence_std": math.sqrt(stats.variance),
+                "sentence_ci": stats.ci(z),
+            }
+            for metric, stats in self.stats.items()
+        }
+
+    def format_summary(self) -> str:
+        return ", ".join(
+            f"{metric} {s['corpus_score']:.4f} "
+            f"(sentence mean {s['sentence_mean']:.4f} ± {s['sentence_ci']:.4f})"
+            for metric, s in self.summary().items()
+            if s["n"]
+        )
+
+    def follow(
+        self,
+        log_paths: List[Union[str, Path]],
+        report_every: int = 1000,
+        poll_interval: float = 1.0,
+        idle_timeout: Optional[float] = None,
+        language_modeling: bool = False,
+    ) -> Dict[str, Dict]:
+        """
+        Scores the samples of fairseq-generate logs (e.g. one per shard) while they
+        are written, logging the running scores every `report_every` samples.
+
+        :param language_modeling: (bool) see `GenerateLogSamples`
+        :return: (Dict) the final `summary`
+        """
+        samples = GenerateLogSamples(language_modeling)
+        next_report = report_every
+        for log_index, line in follow_lines(log_paths, poll_interval, idle_timeout):
+            sample = samples.add_line(log_index, line)
+            if sample is None:
+                continue
+            self.add(*sample)
+            if self.num_samples >= next_report:
+                logger.info(f"{self.num_samples} samples: {self.format_summary()}")
+                next_report += report_every
+        self.flush()
+        logger.info(f"Done, {self.num_samples} samples: {self.format_summary()}")
+        return self.summary()
@@ -0,0 +1,334 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import atexit
+import collections
+import copy
+import functools
+import json
+import logging
+import multiprocessing.util
+import os
+import shutil
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from proc_gen import tracing
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["AsyncCheckpointManager", "install", "load_model_and_task"]
+
+INDEX_FILE = "checkpoints.json"
+# Files that are overwritten by every save, so never removed by the retention policy
+ALIASES = ("checkpoint_last.pt", "checkpoint_best.pt")
+
+
+class AsyncCheckpointManager:
+    """
+    Saves fairseq checkpoints without blocking training for the disk write: the
+    training state is copied to host memory, then written in a background thread
+    while training continues. At most one write is in flight; a save waits for the
+    previous write to finish, and raises the error of that write if it failed.
+
+    After each write, only the last `keep_last` checkpoints and the `keep_best`
+    checkpoints with the lowest validation loss (highest with
+    --maximize-best-checkpoint-metric) are kept. checkpoint_last.pt and
+    checkpoint_best.pt are always kept. Saved checkpoints are listed in
+    `save_dir/checkpoints.json`.
+
+    :param save_dir: (str) checkpoint dir
+    :param keep_last: (int) number of most recent checkpoints to keep, all if <= 0
+    :param keep_best: (int) number of best checkpoints to keep
+    :param maximize: (bool) higher validation scores are better
+    """
+
+    def __init__(
+        self, save_dir: str, keep_last: int = 5, keep_best: int = 3, maximize=False
+    ):
+        self.save_dir = save_dir
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.maximize = maximize
+        self._writer: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        self._index = self._load_index()
+
+    def _load_index(self) -> List[Dict]:
+        path = os.path.join(self.save_dir, INDEX_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def save(self, trainer, filenames: List[str], extra_state: Dict, info: Dict):
+        """
+        Snapshots the training state and writes it to `filenames` in the background.
+
+        :param filenames: (List[str]) file names in `save_dir`; the first is written,
+            the others are copies of it
+        :param info: (Dict) epoch, updates and val_loss of the checkpoint
+        """
+        start = time.perf_counter()
+        # The snapshot must not be taken while the previous one is still being
+        # written, to hold at most two copies of the state in memory
+        self.wait()
+        with tracing.span("train/checkpoint_snapshot"):
+            state = snapshot_state(trainer, extra_state)
+        stall = time.perf_counter() - start
+
+        info = dict(info, file=filenames[0], stall_seconds=round(stall, 3))
+        self._writer = threading.Thread(
+            target=self._run, args=(state, filenames, info), name="checkpoint-writer"
+        )
+        # Not a daemon, so the interpreter waits for the last write before exiting
+        self._writer.start()
+        logger.info(
+            f"snapshot of checkpoint {filenames[0]} took {stall:.3f} seconds "
+            "(training stall), writing in the background"
+        )
+
+    def wait(self):
+        """
+        Blocks until the pending write, if any, is on disk. Raises the exception of
+        the last write if it failed.
+        """
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self, state, filenames: List[str], info: Dict):
+        # Exceptions of a thread are lost, so keep it for the next wait()
+        try:
+            self._write(state, filenames, info)
+        except BaseException as e:
+            logger.error(f"writing checkpoint {filenames[0]} failed: {e!r}")
+            self._error = e
+
+    def _write(self, state, filenames: List[str], info: Dict):
+        import torch
+
+        start = time.perf_counter()
+        paths = [os.path.join(self.save_dir, filename) for filename in filenames]
+        # Write to a temporary file first, so a crash never leaves a partial checkpoint
+        tmp_path = paths[0] + ".tmp"
+        with tracing.span("train/checkpoint_write"):
+            torch.save(state, tmp_path)
+        os.replace(tmp_path, paths[0])
+        for path in paths[1:]:
+            shutil.copyfile(paths[0], tmp_path)
+            os.replace(tmp_path, path)
+
+        info["write_seconds"] = round(time.perf_counter() - start, 3)
+        logger.info(
+            f"saved checkpoint {paths[0]} (epoch {info['epoch']} @ {info['updates']} "
+            f"updates, score {info['val_loss']}) "
+            f"(writing took {info['write_seconds']} seconds)"
+        )
+        if filenames[0] not in ALIASES:
+            self._index = [c for c in self._index if c["file"] != filenames[0]]
+            self._index.append(info)
+        self._apply_retention()
+
+    def _apply_retention(self):
+        by_updates = sorted(self._index, key=lambda c: c["updates"], reverse=True)
+        keep = by_updates if self.keep_last <= 0 else by_updates[: self.keep_last]
+
+        scored = [c for c in self._index if c["val_loss"] is not None]
+        by_score = sorted(scored, key=lambda c: c["val_loss"], reverse=self.maximize)
+        keep_files = {c["file"] for c in keep + by_score[: self.keep_best]}
+
+        for checkpoint in self._index:
+            if checkpoint["file"] not in keep_files:
+                path = os.path.join(self.save_dir, checkpoint["file"])
+                if os.path.lexists(path):
+                    os.remove(path)
+                logger.info(f"removed checkpoint {path}")
+        self._index = sorted(
+            (c for c in self._index if c["file"] in keep_files),
+            key=lambda c: c["updates"],
+        )
+
+        index_path = os.path.join(self.save_dir, INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(index_path + ".tmp", index_path)
+
+
+def snapshot_state(trainer, extra_state: Dict) -> Dict:
+    """
+    Copy in host memory of the checkpoint fairseq would write for `trainer`, which
+    training can't modify while it is being written.
+    """
+    from fairseq import checkpoint_utils
+
+    snapshot = {}
+
+    def capture(state_dict, f):
+        snapshot["state"] = state_dict
+
+    # fairseq's save_state assembles the checkpoint (on CPU) and passes it to
+    # torch_persistent_save, so capture it there instead of writing it to disk
+    persistent_save = checkpoint_utils.torch_persistent_save
+    checkpoint_utils.torch_persistent_save = capture
+    try:
+        trainer.save_checkpoint(os.devnull, extra_state)
+    finally:
+        checkpoint_utils.torch_persistent_save = persistent_save
+
+    # On CPU, the captured tensors share memory with the model and optimizer
+    return copy.deepcopy(snapshot["state"])
+
+
+def checkpoint_filenames(args, epoch_itr, updates: int, is_best: bool) -> List[str]:
+    """Names of the checkpoints fairseq saves at this point of training."""
+    epoch = epoch_itr.epoch
+    end_of_epoch = epoch_itr.end_of_epoch()
+
+    conds = collections.OrderedDict()
+    conds[f"checkpoint{epoch}.pt"] = (
+        end_of_epoch
+        and not args.no_epoch_checkpoints
+        and epoch % args.save_interval == 0
+    )
+    conds[f"checkpoint_{epoch}_{updates}.pt"] = (
+        not end_of_epoch
+        and args.save_interval_updates > 0
+        and updates % args.save_interval_updates == 0
+    )
+    conds["checkpoint_best.pt"] = is_best
+    conds["checkpoint_last.pt"] = not args.no_last_checkpoints
+    return [filename for filename, cond in conds.items() if cond]
+
+
+def load_model_and_task(data_bin, ckpt_path, cpu: bool = False):
+    """
+    :param data_bin: (Path) data-bin dir the checkpoint's task loads its dictionaries
+        and datasets from
+    :param cpu: (bool) keep the model on CPU, even if a GPU is available
+    :return: (FairseqModel) the model of the checkpoint, in eval mode, and
+        (FairseqTask) its task
+    """
+    import torch
+    from fairseq import checkpoint_utils
+
+    models, _, task = checkpoint_utils.load_model_ensemble_and_task(
+        [str(ckpt_path)], arg_overrides={"data": str(data_bin)}
+    )
+    model = models[0].eval()
+    if not cpu and torch.cuda.is_available():
+        model.cuda()
+    return model, task
+
+
+def install():
+    """
+    Replaces fairseq's `checkpoint_utils.save_checkpoint` by one that uses an
+    `AsyncCheckpointManager` when training args have `async_checkpoints` set (see
+    pg-train-model), with retention from `checkpoint_keep_last` and
+    `checkpoint_keep_best`. Other training runs save synchronously, as before.
+
+    At exit, the process waits for the pending writes, and exits with status 1 if
+    one of them failed (e.g. the write of the final checkpoint).
+    """
+    from fairseq import checkpoint_utils
+
+    if getattr(checkpoint_utils.save_checkpoint, "is_async", False):
+        return
+    fairseq_save_checkpoint = checkpoint_utils.save_checkpoint
+    managers = {}
+
+    @functools.wraps(fairseq_save_checkpoint)
+    def save_checkpoint(args, trainer, epoch_itr, val_loss):
+        if not getattr(args, "async_checkpoints", False):
+            # fairseq tracks the best score on checkpoint_utils.save_checkpoint,
+            # which is this function once installed
+            return fairseq_save_checkpoint(args, trainer, epoch_itr, val_loss)
+
+        if args.distributed_rank == 0:
+            os.makedirs(args.save_dir, exist_ok=True)
+
+        def is_better(a, b):
+            return a >= b if args.maximize_best_checkpoint_metric else a <= b
+
+        is_best = val_loss is not None and (
+            not hasattr(save_checkpoint, "best")
+            or is_better(val_loss, save_checkpoint.best)
+        )
+        prev_best = getattr(save_checkpoint, "best", val_loss)
+        if val_loss is not None:
+            best_function = max if args.maximize_best_checkpoint_metric else min
+            save_checkpoint.best = best_function(val_loss, prev_best)
+
+        if args.no_save:
+            return
+        if hasattr(trainer, "consolidate_optimizer"):
+            trainer.consolidate_optimizer()
+        if not trainer.is_data_parallel_master:
+            return
+
+        updates = trainer.get_num_updates()
+        filenames = checkpoint_filenames(args, epoch_itr, updates, is_best)
+        if not filenames:
+            return
+
+        extra_state = {"train_iterator": epoch_itr.state_dict(), "val_loss": val_loss}
+        if hasattr(save_checkpoint, "best"):
+            extra_state["best"] = save_checkpoint.best
+
+        if args.save_dir not in managers:
+            managers[args.save_dir] = AsyncCheckpointManager(
+                args.save_dir,
+                keep_last=args.checkpoint_keep_last,
+                keep_best=args.checkpoint_keep_best,
+                maximize=args.maximize_best_checkpoint_metric,
+            )
+        info = {
+            "epoch": epoch_itr.epoch,
+            "updates": updates,
+            "val_loss": None if val_loss is None else float(val_loss),
+        }
+        managers[args.save_dir].save(trainer, filenames, extra_state, info)
+
+    def wait_for_writes():
+        # The writer thread only logs its error, so it would be lost when no
+        # save follows it
+        failed = False
+        for manager in managers.values():
+            try:
+                manager.wait()
+            except BaseException:
+                failed = True
+        managers.clear()
+        if failed:
+            logger.error("a checkpoint write failed, exiting with status 1")
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(1)
+
+    atexit.register(wait_for_writes)
+    # Spawned (distributed) training processes exit without running atexit hooks
+    multiprocessing.util.Finalize(None, wait_for_writes, exitpriority=0)
+
+    save_checkpoint.is_async = True
+    checkpoint_utils.save_checkpoint = save_checkpoint
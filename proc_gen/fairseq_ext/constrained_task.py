@@ -0,0 +1,187 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+import math
+from typing import List
+
+import torch
+from fairseq import utils
+from fairseq.search import LexicallyConstrainedBeamSearch
+from fairseq.tasks import register_task
+from fairseq.tasks.translation import TranslationTask
+from fairseq.token_generation_constraints import pack_constraints
+
+from proc_gen.data.to_example import (
+    PROBLEM_TO_LAYOUT,
+    REQUIREMENTS,
+    string_to_requirements,
+)
+from proc_gen.problems import Problem
+
+logger = logging.getLogger(__name__)
+
+# Translation problems that generate tasks from the requirements in the source
+CONSTRAINED_PROBLEMS = (
+    Problem.Requirements_TO_TargetProductAndTasks,
+    Problem.TargetProductAndRequirements_TO_Tasks,
+)
+
+
+def requirement_head_words(
+    source: str, problem: Problem, essential_only: bool = False
+) -> List[str]:
+    """
+    Head word (last word) of the object of every requirement in `source`. The
+    requirement coverage scorers count a requirement as covered if the generated
+    tasks mention any word of its object.
+
+    :param source: (str) tokenized source of an example of `problem`
+    :param essential_only: (bool) skip optional requirements
+    :return: (List[str]) head words, without duplicates
+    """
+    src_layout = PROBLEM_TO_LAYOUT[problem][0]
+    # Fields alternate with their separators
+    fields = {}
+    rest = source
+    for field, sep in zip(src_layout[::2], src_layout[1::2] + (None,)):
+        if sep is None:
+            fields[field] = rest
+        else:
+            fields[field], _, rest = rest.partition(f" {sep} ")
+
+    try:
+        requirements = string_to_requirements(fields[REQUIREMENTS])
+    except ValueError:
+        return []
+
+    head_words, seen = [], set()
+    for req in requirements:
+        if essential_only and req.optional:
+            continue
+        words = [w for w in req.object.split() if any(c.isalnum() for c in w)]
+        if words and words[-1].lower() not in seen:
+            seen.add(words[-1].lower())
+            head_words.append(words[-1])
+    return head_words
+
+
+class RequirementConstrainedBeamSearch(LexicallyConstrainedBeamSearch):
+    """
+    Lexically constrained beam search that ends hypotheses at the max length, even if
+    they don't meet their constraints. fairseq's blocks eos until all constraints are
+    met, while the generator only allows eos at the max length, so generation fails
+    on hypotheses whose constraints don't fit.
+    """
+
+    def step(
+        self,
+        step: int,
+        lprobs: torch.Tensor,
+        scores,
+        prev_output_tokens=None,
+        original_batch_idxs=None,
+    ):
+        eos = self.eos
+        at_max_len = step > 0 and bool(
+            (lprobs[:, :, :eos] == -math.inf).all()
+            and (lprobs[:, :, eos + 1 :] == -math.inf).all()
+        )
+        if not at_max_len:
+            return super().step(
+                step, lprobs, scores, prev_output_tokens, original_batch_idxs
+            )
+        # Plain beam search, i.e. without the constraints, for this last step
+        constraint_states, self.constraint_states = self.constraint_states, []
+        try:
+            return super().step(
+                step, lprobs, scores, prev_output_tokens, original_batch_idxs
+            )
+        finally:
+            self.constraint_states = constraint_states
+
+
+@register_task("requirement_constrained_translation")
+class RequirementConstrainedTranslationTask(TranslationTask):
+    """
+    Translation whose generated tasks must mention the requirements of the source:
+    with fairseq's constrained beam search (--constraints unordered), the head words
+    of the requirements (see `requirement_head_words`) are lexical constraints of
+    every example. Without --constraints, this is plain translation.
+
+    The problem follows from the language pair, e.g. Requirements ->
+    TargetProductAndTasks.
+    """
+
+    @staticmethod
+    def add_args(parser):
+        TranslationTask.add_args(parser)
+        parser.add_argument(
+            "--essential-requirements-only",
+            action="store_true",
+            help="only constrain the output to mention the non-optional requirements",
+        )
+
+    def __init__(self, args, src_dict, tgt_dict):
+        super().__init__(args, src_dict, tgt_dict)
+        self.problem = Problem[f"{args.source_lang}_TO_{args.target_lang}"]
+        if self.problem not in CONSTRAINED_PROBLEMS:
+            raise ValueError(
+                f"{self.problem.name} doesn't generate tasks from requirements"
+            )
+
+    def build_generator(self, models, args, **kwargs):
+        generator = super().build_generator(models, args, **kwargs)
+        if getattr(args, "constraints", None):
+            generator.search = RequirementConstrainedBeamSearch(
+                self.target_dictionary, args.constraints
+            )
+        return generator
+
+    def inference_step(
+        self, generator, models, sample, prefix_tokens=None, constraints=None
+    ):
+        if constraints is None and generator.search.supports_constraints:
+            constraints = self.requirement_constraints(
+                sample["net_input"]["src_tokens"]
+            )
+        return super().inference_step(
+            generator,
+            models,
+            sample,
+            prefix_tokens=prefix_tokens,
+            constraints=constraints,
+        )
+
+    def requirement_constraints(self, src_tokens: torch.Tensor) -> torch.Tensor:
+        """
+        :param src_tokens: (torch.Tensor) padded batch of sources
+        :return: (torch.Tensor) packed constraints of the batch (see
+            fairseq.token_generation_constraints.pack_constraints)
+        """
+        essential_only = getattr(self.args, "essential_requirements_only", False)
+        unk = self.tgt_dict.unk()
+        batch_constraints = []
+        for tokens in src_tokens:
+            source = self.src_dict.string(utils.strip_pad(tokens, self.src_dict.pad()))
+            ids = [
+                self.tgt_dict.index(word)
+                for word in requirement_head_words(source, self.problem, essential_only)
+            ]
+            batch_constraints.append([torch.LongTensor([i]) for i in ids if i != unk])
+        return pack_constraints(batch_constraints).to(src_tokens.device)
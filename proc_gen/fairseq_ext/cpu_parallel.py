@@ -0,0 +1,107 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import functools
+import logging
+import os
+import random
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["spawn_cpu_workers"]
+
+
+def report_rank_throughput(rank: int, log_interval: int):
+    """Logs the training throughput of this rank every `log_interval` updates."""
+    from fairseq.trainer import Trainer
+
+    # fairseq only logs warnings on ranks other than 0
+    logger.setLevel(logging.INFO)
+
+    train_step = Trainer.train_step
+    totals = {"tokens": 0, "seconds": 0.0, "updates": 0}
+
+    @functools.wraps(train_step)
+    def timed_train_step(self, samples, *args, **kwargs):
+        start = time.perf_counter()
+        output = train_step(self, samples, *args, **kwargs)
+        totals["seconds"] += time.perf_counter() - start
+        # Tokens of this rank's local batches (dummy batches are empty)
+        totals["tokens"] += sum(
+            sample.get("ntokens", 0) for sample in samples if sample
+        )
+        totals["updates"] += 1
+
+        if totals["updates"] % log_interval == 0:
+            logger.info(
+                f"rank {rank}: {totals['tokens'] / totals['seconds']:.1f} tokens/s "
+                f"over the last {log_interval} updates"
+            )
+            totals["tokens"], totals["seconds"] = 0, 0.0
+        return output
+
+    Trainer.train_step = timed_train_step
+
+
+def cpu_distributed_main(rank: int, train_args, num_threads: int):
+    """Entry point of a spawned CPU training process, see `spawn_cpu_workers`."""
+    from fairseq_cli import train
+
+    # Intra-op parallelism of each rank, so ranks don't compete for the same cores
+    torch.set_num_threads(num_threads)
+    report_rank_throughput(rank, train_args.log_interval)
+
+    train.distributed_main(rank, train_args)
+
+
+def spawn_cpu_workers(train_args, num_workers: int, num_threads: int = None):
+    """
+    Data-parallel training on CPU: spawns `num_workers` local ranks, which average
+    gradients over gloo.
+
+    :param num_threads: (int) intra-op threads per rank,
+        defaults to the number of cores divided by the number of ranks
+    """
+    if num_threads is None:
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    train_args.cpu = True
+    train_args.distributed_world_size = num_workers
+    train_args.distributed_backend = "gloo"
+    # fairseq's c10d wrapper pins modules to a GPU (device_ids), while no_c10d
+    # all-reduces flattened gradients, which gloo supports for CPU tensors
+    train_args.ddp_backend = "no_c10d"
+    port = random.randint(10000, 20000)
+    train_args.distributed_init_method = "tcp://localhost:{port}".format(port=port)
+    train_args.distributed_rank = None  # set based on process index
+
+    # Also limits the OpenMP/MKL thread pools of the spawned processes
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    os.environ["MKL_NUM_THREADS"] = str(num_threads)
+
+    logger.info(
+        f"Spawning {num_workers} CPU training processes, {num_threads} threads each."
+    )
+    torch.multiprocessing.spawn(
+        fn=cpu_distributed_main,
+        args=(train_args, num_threads),
+        nprocs=num_workers,
+    )
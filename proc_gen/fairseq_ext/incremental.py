@@ -0,0 +1,113 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Incremental decoding of several tokens at once with fairseq TransformerDecoders
+(transformer, bart, transformer_lm).
+
+fairseq's incremental decoding feeds one token per call: given an incremental
+state, the decoder only runs the last token. `extend` runs any number of new tokens
+in one pass, attending to the cached keys and values and causally to each other,
+and `truncate` rolls the cache back, e.g. after rejected speculative tokens.
+"""
+from typing import Dict, Optional
+
+import torch
+
+__all__ = ["IncrementalState", "extend", "truncate"]
+
+IncrementalState = Dict[str, Dict[str, Optional[torch.Tensor]]]
+
+
+def extend(
+    decoder,
+    tokens: torch.Tensor,
+    num_new: int,
+    incremental_state: IncrementalState,
+    encoder_out=None,
+) -> torch.Tensor:
+    """
+    Runs the last `num_new` of `tokens` through `decoder`, adding them to
+    `incremental_state`, which holds the other tokens.
+
+    :param tokens: (torch.Tensor) all tokens so far, B x T
+    :param encoder_out: (EncoderOut) output of the encoder, for encoder-decoder models
+    :return: (torch.Tensor) decoder features of the new tokens, B x num_new x C (see
+        decoder.output_layer)
+    """
+    # Copyright (c) Facebook, Inc. and its affiliates.
+    # The code in this function is licensed under the MIT license.
+    # TransformerDecoder.extract_features, feeding `num_new` tokens instead of the
+    # last one
+    num_cached = tokens.size(1) - num_new
+    positions = (
+        decoder.embed_positions(tokens)[:, num_cached:]
+        if decoder.embed_positions is not None
+        else None
+    )
+    x = decoder.embed_scale * decoder.embed_tokens(tokens[:, num_cached:])
+    if decoder.quant_noise is not None:
+        x = decoder.quant_noise(x)
+    if decoder.project_in_dim is not None:
+        x = decoder.project_in_dim(x)
+    if positions is not None:
+        x += positions
+    if decoder.layernorm_embedding is not None:
+        x = decoder.layernorm_embedding(x)
+    x = decoder.dropout_module(x)
+
+    # B x T x C -> T x B x C
+    x = x.transpose(0, 1)
+    # New token i attends to the cached tokens and new tokens up to i
+    self_attn_mask = torch.triu(
+        x.new_full((num_new, tokens.size(1)), -float("inf")), num_cached + 1
+    )
+    for layer in decoder.layers:
+        x, _, _ = layer(
+            x,
+            encoder_out.encoder_out if encoder_out is not None else None,
+            encoder_out.encoder_padding_mask if encoder_out is not None else None,
+            incremental_state,
+            self_attn_mask=self_attn_mask,
+        )
+    if decoder.layer_norm is not None:
+        x = decoder.layer_norm(x)
+    # T x B x C -> B x T x C
+    x = x.transpose(0, 1)
+    if decoder.project_out_dim is not None:
+        x = decoder.project_out_dim(x)
+    return x
+
+
+def truncate(decoder, incremental_state: IncrementalState, length: int):
+    """Keeps the first `length` tokens in the self-attention caches of `decoder`."""
+    for layer in decoder.layers:
+        buffer = layer.self_attn._get_input_buffer(incremental_state)
+        if "prev_key" not in buffer:
+            continue
+        truncated = {
+            "prev_key": buffer["prev_key"][:, :, :length],
+            "prev_value": buffer["prev_value"][:, :, :length],
+            "prev_key_padding_mask": (
+                buffer["prev_key_padding_mask"][:, :length]
+                if buffer.get("prev_key_padding_mask") is not None
+                else None
+            ),
+        }
+        # A new buffer, the cache may be shared with forks of the state
+        layer.self_attn._set_input_buffer(incremental_state, truncated)
@@ -0,0 +1,295 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Generation for decoder-only (language) models, e.g. transformer_lm_gpt2_small, that
+encodes every prompt once.
+
+fairseq's SequenceGenerator feeds a prompt (prefix tokens) through the decoder one
+token per step, for every sample or beam of it. Here, the prompt goes through the
+decoder in a single pass, and the resulting incremental state (the keys and values
+of every attention layer) is forked across the samples or beams, which only decode
+the continuation.
+"""
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+from fairseq.data import data_utils
+
+from proc_gen.data.to_example import REQUIREMENTS_TP_SEP, TARGET_PRODUCT_SEP
+from proc_gen.fairseq_ext import incremental
+from proc_gen.fairseq_ext.incremental import IncrementalState
+from proc_gen.fairseq_ext.shuffle_task import ProcedureShuffleTask
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["PrefixCachedGenerator", "load_examples", "get_prompt", "load_prompts"]
+
+
+def load_examples(task, split: str = "test") -> Iterator[Tuple[int, torch.Tensor]]:
+    """
+    :param task: (FairseqTask) language_modeling or procedure_shuffle task
+    :return: (int, torch.Tensor) example index and example (without eos), per example
+        of `split`
+    """
+    dictionary = task.source_dictionary
+    if isinstance(task, ProcedureShuffleTask):
+        task.load_dataset(split)
+        dataset = task.dataset(split)
+        lines = (dataset[i]["target"] for i in range(len(dataset)))
+    else:
+        data_path = task.args.data.split(os.pathsep)[0]
+        dataset = data_utils.load_indexed_dataset(
+            os.path.join(data_path, split), dictionary, task.args.dataset_impl
+        )
+        if dataset is None:
+            raise FileNotFoundError(f"Dataset not found: {split} ({data_path})")
+        lines = (dataset[i] for i in range(len(dataset)))
+
+    for i, line in enumerate(lines):
+        yield i, line[line.ne(dictionary.eos())]
+
+
+def get_prompt(example: torch.Tensor, dictionary) -> torch.Tensor:
+    """
+    Prompt of a language modeling example: the tokens up to and including the first
+    <rts> separator (or <tps> if there's none), e.g. the requirements of
+    RequirementsAndTargetProductAndTasks (pg-evaluate-model scores what follows the
+    first <rts>).
+
+    :return: (torch.Tensor) the prompt (the whole example if it has no separator)
+    """
+    for sep in [
+        dictionary.index(REQUIREMENTS_TP_SEP),
+        dictionary.index(TARGET_PRODUCT_SEP),
+    ]:
+        positions = example.eq(sep).nonzero(as_tuple=False)
+        if len(positions):
+            return example[: positions[0, 0] + 1]
+    return example
+
+
+def load_prompts(task, split: str = "test") -> Iterator[Tuple[int, torch.Tensor]]:
+    """
+    Prompts (see `get_prompt`) of the language modeling examples of `split`.
+
+    :param task: (FairseqTask) language_modeling or procedure_shuffle task
+    :return: (int, torch.Tensor) example index and prompt, per example
+    """
+    for i, example in load_examples(task, split):
+        yield i, get_prompt(example, task.source_dictionary)
+
+
+class PrefixCachedGenerator:
+    """
+    Samples or beam searches continuations of prompts, computing the incremental
+    decoder state of a prompt once and forking it across its samples or beams.
+    The states of the `cache_size` most recent prompts are kept, so generating from
+    the same prompt again skips the prompt entirely.
+
+    :param model: (FairseqLanguageModel) model with a fairseq TransformerDecoder
+    :param max_len: (int) max number of generated tokens (excluding eos)
+    :param temperature: (float) sampling temperature
+    :param sampling_topk: (int) sample from the `sampling_topk` most likely tokens
+        only, if > 0
+    """
+
+    def __init__(
+        self,
+        model,
+        dictionary,
+        max_len: int = 200,
+        temperature: float = 1.0,
+        sampling_topk: int = -1,
+        cache_size: int = 16,
+    ):
+        self.model = model
+        self.decoder = model.decoder
+        self.device = next(model.parameters()).device
+        self.eos = dictionary.eos()
+        self.pad = dictionary.pad()
+        self.max_len = max_len
+        self.temperature = temperature
+        self.sampling_topk = sampling_topk
+        self.cache_size = cache_size
+        self._primed: "OrderedDict[tuple, Tuple[IncrementalState, torch.Tensor]]" = (
+            OrderedDict()
+        )
+
+    @torch.no_grad()
+    def prime(self, prompt: torch.Tensor) -> Tuple[IncrementalState, torch.Tensor]:
+        """
+        Runs `prompt` (1D, without bos) through the decoder in one pass.
+
+        :return: (dict) incremental state after the prompt, for a batch of one, and
+            (torch.Tensor) log-probabilities of the next token, of shape (1, V)
+        """
+        key = tuple(prompt.tolist())
+        if key in self._primed:
+            self._primed.move_to_end(key)
+            return self._primed[key]
+
+        tokens = torch.cat([prompt.new([self.eos]), prompt]).unsqueeze(0)
+        state: IncrementalState = {}
+        features = incremental.extend(self.decoder, tokens, tokens.size(1), state)
+        lprobs = self._normalize(self.decoder.output_layer(features[:, -1:]))
+
+        self._primed[key] = state, lprobs
+        if len(self._primed) > self.cache_size:
+            self._primed.popitem(last=False)
+        return state, lprobs
+
+    def fork(self, state: IncrementalState, num_copies: int) -> IncrementalState:
+        """Repeats a state of one prompt `num_copies` times, leaving `state` as is."""
+        forked = {key: dict(buffer) for key, buffer in state.items()}
+        order = torch.zeros(num_copies, dtype=torch.long, device=self.device)
+        self.decoder.reorder_incremental_state_scripting(forked, order)
+        return forked
+
+    def _max_len(self, prompt: torch.Tensor) -> int:
+        # The fed tokens (bos, prompt and all but the last generated token) need
+        # positions, a prompt that fills them all only gets eos
+        max_len = self.decoder.max_positions() - len(prompt) - 1
+        return max(0, min(self.max_len, max_len))
+
+    def _normalize(self, logits: torch.Tensor) -> torch.Tensor:
+        lprobs = self.model.get_normalized_probs((logits, None), log_probs=True)
+        lprobs = lprobs[:, -1, :].float()
+        lprobs[:, self.pad] = -float("inf")
+        return lprobs
+
+    @torch.no_grad()
+    def _step(self, tokens: torch.Tensor, state: IncrementalState) -> torch.Tensor:
+        logits, _ = self.decoder(tokens, incremental_state=state)
+        return self._normalize(logits)
+
+    @torch.no_grad()
+    def sample(self, prompt: torch.Tensor, num_samples: int = 1) -> List[Dict]:
+        """
+        :return: (List[Dict]) per sample, the generated `tokens` (ending with eos)
+            and their mean log-probability `score`
+        """
+        prompt = prompt.to(self.device)
+        primed, lprobs = self.prime(prompt)
+        state = self.fork(primed, num_samples)
+        lprobs = lprobs.expand(num_samples, -1)
+        tokens = torch.cat([prompt.new([self.eos]), prompt]).repeat(num_samples, 1)
+
+        max_len = self._max_len(prompt)
+        active = list(range(num_samples))
+        scores = torch.zeros(num_samples, device=self.device)
+        results: List[Optional[Dict]] = [None] * num_samples
+        for step in range(max_len + 1):
+            if step == max_len:
+                next_tokens = tokens.new_full((len(active),), self.eos)
+            else:
+                if self.temperature != 1.0:
+                    lprobs = F.log_softmax(lprobs / self.temperature, dim=-1)
+                probs = lprobs.exp()
+                if self.sampling_topk > 0:
+                    top_probs, top_indices = probs.topk(self.sampling_topk, dim=-1)
+                    choice = torch.multinomial(top_probs, 1)
+                    next_tokens = top_indices.gather(1, choice).squeeze(1)
+                else:
+                    next_tokens = torch.multinomial(probs, 1).squeeze(1)
+            scores += lprobs.gather(1, next_tokens.unsqueeze(1)).squeeze(1)
+            tokens = torch.cat([tokens, next_tokens.unsqueeze(1)], dim=1)
+
+            done = next_tokens.eq(self.eos)
+            for row in done.nonzero(as_tuple=False).squeeze(1).tolist():
+                results[active[row]] = {
+                    "tokens": tokens[row, len(prompt) + 1 :],
+                    "score": float(scores[row]) / (step + 1),
+                }
+            if done.all():
+                break
+            if done.any():
+                keep = (~done).nonzero(as_tuple=False).squeeze(1)
+                self.decoder.reorder_incremental_state_scripting(state, keep)
+                active = [active[row] for row in keep.tolist()]
+                tokens, scores = tokens[keep], scores[keep]
+            lprobs = self._step(tokens, state)
+        return results
+
+    @torch.no_grad()
+    def beam_search(
+        self, prompt: torch.Tensor, beam: int = 5, nbest: int = 1, lenpen: float = 1.0
+    ) -> List[Dict]:
+        """
+        :return: (List[Dict]) the `nbest` best hypotheses: generated `tokens` (ending
+            with eos) and their length normalized log-probability `score`
+        """
+        prompt = prompt.to(self.device)
+        primed, lprobs = self.prime(prompt)
+        state = self.fork(primed, beam)
+        tokens = torch.cat([prompt.new([self.eos]), prompt]).repeat(beam, 1)
+        scores = torch.zeros(beam, device=self.device)
+        vocab_size = lprobs.size(-1)
+        max_len = self._max_len(prompt)
+
+        finalized: List[Dict] = []
+        for step in range(max_len + 1):
+            if step == max_len:
+                # Only eos at the max length
+                eos_lprobs = lprobs[:, self.eos].clone()
+                lprobs = torch.full_like(lprobs, -float("inf"))
+                lprobs[:, self.eos] = eos_lprobs
+            if step == 0:
+                # All beams are the same (the prompt)
+                cand_scores = lprobs[0]
+            else:
+                cand_scores = (scores.unsqueeze(1) + lprobs).view(-1)
+            top_scores, top_indices = cand_scores.topk(2 * beam)
+            cand_beams = top_indices // vocab_size
+            cand_tokens = top_indices % vocab_size
+
+            # Hypotheses ending with eos among the top `beam` candidates are done
+            keep = []
+            for i in range(2 * beam):
+                if cand_tokens[i] == self.eos:
+                    if i < beam and top_scores[i] > -float("inf"):
+                        finalized.append(
+                            {
+                                "tokens": torch.cat(
+                                    [
+                                        tokens[cand_beams[i], len(prompt) + 1 :],
+                                        cand_tokens[i : i + 1],
+                                    ]
+                                ),
+                                "score": float(top_scores[i]) / (step + 1) ** lenpen,
+                            }
+                        )
+                elif len(keep) < beam:
+                    keep.append(i)
+            if len(finalized) >= beam or step == max_len:
+                break
+
+            keep = torch.tensor(keep, device=self.device)
+            kept_beams = cand_beams[keep]
+            self.decoder.reorder_incremental_state_scripting(state, kept_beams)
+            tokens = torch.cat(
+                [tokens[kept_beams], cand_tokens[keep].unsqueeze(1)], dim=1
+            )
+            scores = top_scores[keep]
+            lprobs = self._step(tokens, state)
+
+        return sorted(finalized, key=lambda hypo: -hypo["score"])[:nbest]
@@ -0,0 +1,212 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import logging
+import os
+
+import numpy as np
+import torch
+from fairseq import utils
+from fairseq.data import Dictionary, FairseqDataset, data_utils
+from fairseq.data.monolingual_dataset import collate
+from fairseq.tasks import FairseqTask, register_task
+
+from proc_gen.data.to_example import REQUIREMENTS_TP_SEP, TARGET_PRODUCT_SEP
+
+logger = logging.getLogger(__name__)
+
+# Languages of the binarized requirements -> target product pairs (see pg-prepare-data)
+REQUIREMENTS_LANG = "Requirements"
+TARGET_PRODUCT_LANG = "TargetProduct"
+
+
+class ProcedureShuffleDataset(FairseqDataset):
+    """
+    Language modeling examples of a procedure, in a layout that is sampled per
+    example and per epoch:
+        requirements <rts> target product   (requirements -> target product)
+        target product <tps> requirements   (target product -> requirements)
+
+    Requirements and target products are stored once, as binarized segments. The
+    example is only assembled when it is loaded, so no layout is materialized on disk.
+
+    :param requirements: (FairseqDataset) requirements per procedure, ending with eos
+    :param target_products: (FairseqDataset) target product per procedure, ending with eos
+    :param requirements_first_prob: (float) probability of the requirements -> target
+        product layout
+    :param resample: (bool) sample new layouts every epoch (train) or keep the layouts
+        of the first epoch (valid/test)
+    """
+
+    def __init__(
+        self,
+        requirements: FairseqDataset,
+        target_products: FairseqDataset,
+        dictionary: Dictionary,
+        requirements_first_prob: float = 0.5,
+        seed: int = 1,
+        shuffle: bool = True,
+        resample: bool = True,
+    ):
+        assert len(requirements) == len(target_products)
+        self.requirements = requirements
+        self.target_products = target_products
+        self.dictionary = dictionary
+        self.rts = dictionary.index(REQUIREMENTS_TP_SEP)
+        self.tps = dictionary.index(TARGET_PRODUCT_SEP)
+        self.requirements_first_prob = requirements_first_prob
+        self.seed = seed
+        self.shuffle = shuffle
+        self.resample = resample
+
+        # Both layouts replace one eos by a separator, so have the same size
+        self.sizes = np.asarray(requirements.sizes) + np.asarray(target_products.sizes)
+        self.set_epoch(1)
+
+    def set_epoch(self, epoch: int):
+        if epoch > 1 and not self.resample:
+            return
+        self.epoch = epoch
+        rng = np.random.RandomState([self.seed, epoch])
+        self.requirements_first = rng.rand(len(self)) < self.requirements_first_prob
+
+    @property
+    def can_reuse_epoch_itr_across_epochs(self):
+        # Batches only depend on the sizes, which are the same for both layouts
+        return True
+
+    def __getitem__(self, index: int):
+        requirements = self.requirements[index][:-1]
+        target_product = self.target_products[index][:-1]
+        if self.requirements_first[index]:
+            first, sep, second = requirements, self.rts, target_product
+        else:
+            first, sep, second = target_product, self.tps, requirements
+
+        eos = self.dictionary.eos()
+        target = torch.cat([first, first.new([sep]), second, first.new([eos])])
+        source = torch.cat([target.new([eos]), target[:-1]])
+
+        return {"id": index, "source": source, "target": target}
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def collater(self, samples):
+        return collate(samples, self.dictionary.pad(), self.dictionary.eos())
+
+    def num_tokens(self, index: int):
+        return self.sizes[index]
+
+    def size(self, index: int):
+        return self.sizes[index]
+
+    def ordered_indices(self):
+        if self.shuffle:
+            order = [np.random.permutation(len(self))]
+        else:
+            order = [np.arange(len(self))]
+        order.append(self.sizes)
+        return np.lexsort(order)
+
+    @property
+    def supports_prefetch(self):
+        return False
+
+
+@register_task("procedure_shuffle")
+class ProcedureShuffleTask(FairseqTask):
+    """
+    Language modeling on procedures, prompting with either the requirements or the
+    target product (Problem.RequirementsAndTargetProductShuffle).
+
+    Expects the data dir of a Requirements -> TargetProduct translation dataset with
+    a joined dictionary.
+    """
+
+    @staticmethod
+    def add_args(parser):
+        parser.add_argument("data", help="colon separated path to data directories")
+        parser.add_argument(
+            "--requirements-first-prob",
+            type=float,
+            default=0.5,
+            help="probability of the requirements -> target product layout",
+        )
+        parser.add_argument(
+            "--tokens-per-sample",
+            type=int,
+            default=1024,
+            help="max number of tokens per example",
+        )
+
+    def __init__(self, args, dictionary: Dictionary):
+        super().__init__(args)
+        self.args = args
+        self.dictionary = dictionary
+
+    @classmethod
+    def setup_task(cls, args, **kwargs):
+        paths = utils.split_paths(args.data)
+        assert len(paths) > 0
+        dictionary = Dictionary.load(
+            os.path.join(paths[0], f"dict.{REQUIREMENTS_LANG}.txt")
+        )
+        # Separators of the sampled layouts don't occur in the binarized segments
+        for symbol in (REQUIREMENTS_TP_SEP, TARGET_PRODUCT_SEP):
+            dictionary.add_symbol(symbol)
+        logger.info(f"dictionary: {len(dictionary)} types")
+
+        return cls(args, dictionary)
+
+    def load_dataset(self, split, epoch=1, combine=False, **kwargs):
+        paths = utils.split_paths(self.args.data)
+        data_path = paths[(epoch - 1) % len(paths)]
+
+        def load(lang):
+            prefix = os.path.join(
+                data_path, f"{split}.{REQUIREMENTS_LANG}-{TARGET_PRODUCT_LANG}.{lang}"
+            )
+            dataset = data_utils.load_indexed_dataset(
+                prefix, self.dictionary, self.args.dataset_impl
+            )
+            if dataset is None:
+                raise FileNotFoundError(f"Dataset not found: {split} ({prefix})")
+            return dataset
+
+        self.datasets[split] = ProcedureShuffleDataset(
+            load(REQUIREMENTS_LANG),
+            load(TARGET_PRODUCT_LANG),
+            self.dictionary,
+            requirements_first_prob=self.args.requirements_first_prob,
+            seed=self.args.seed,
+            shuffle=split == getattr(self.args, "train_subset", "train"),
+            resample=split == getattr(self.args, "train_subset", "train"),
+        )
+        logger.info(f"{data_path} {split} {len(self.datasets[split])} examples")
+
+    def max_positions(self):
+        return self.args.tokens_per_sample
+
+    @property
+    def source_dictionary(self):
+        return self.dictionary
+
+    @property
+    def target_dictionary(self):
+        return self.dictionary
@@ -0,0 +1,184 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Speculative greedy decoding for encoder-decoder models with a TransformerDecoder
+(transformer, bart).
+
+A small draft model with the same dictionary (e.g. a transformer trained with
+transformer_conf on the same data-bin) proposes a few tokens greedily, and the
+model scores them all in one decoder pass. The proposed tokens that match the
+model's greedy choice are kept, followed by the model's own next token, so the
+output is the model's greedy output.
+"""
+import logging
+from typing import Dict
+
+import torch
+
+from proc_gen.fairseq_ext import incremental
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["SpeculativeGreedyGenerator"]
+
+
+class SpeculativeGreedyGenerator:
+    """
+    Greedy decoding with `model`, speculating with `draft_model`. Generates up to
+    max_len_a * src_len + max_len_b tokens (excluding eos), like fairseq's
+    SequenceGenerator with --beam 1.
+
+    :param num_draft_tokens: (int) tokens proposed by the draft model per step
+    :param min_len: (int) min number of generated tokens (including eos)
+    """
+
+    def __init__(
+        self,
+        model,
+        draft_model,
+        dictionary,
+        num_draft_tokens: int = 4,
+        max_len_a: float = 0,
+        max_len_b: int = 200,
+        min_len: int = 1,
+    ):
+        if (
+            model.decoder.embed_tokens.num_embeddings
+            != draft_model.decoder.embed_tokens.num_embeddings
+        ):
+            raise ValueError(
+                "The draft model must have the dictionary of the model "
+                "(trained on the same data-bin)."
+            )
+        self.model = model
+        self.draft_model = draft_model
+        self.eos = dictionary.eos()
+        self.pad = dictionary.pad()
+        self.num_draft_tokens = num_draft_tokens
+        self.max_len_a = max_len_a
+        self.max_len_b = max_len_b
+        self.min_len = min_len
+        self.device = next(model.parameters()).device
+
+    def _mask(self, lprobs: torch.Tensor, first_step: int, max_len: int):
+        """Masks the log-probabilities of (consecutive) steps, like fairseq does."""
+        lprobs[:, self.pad] = -float("inf")
+        for i in range(lprobs.size(0)):
+            step = first_step + i
+            if step >= max_len:
+                eos_lprob = lprobs[i, self.eos].item()
+                lprobs[i] = -float("inf")
+                lprobs[i, self.eos] = eos_lprob
+            elif step < self.min_len:
+                lprobs[i, self.eos] = -float("inf")
+        return lprobs
+
+    def _lprobs(self, model, features: torch.Tensor) -> torch.Tensor:
+        logits = model.decoder.output_layer(features)
+        return model.get_normalized_probs((logits, None), log_probs=True)[0].float()
+
+    @torch.no_grad()
+    def generate(self, src_tokens: torch.Tensor) -> Dict:
+        """
+        :param src_tokens: (torch.Tensor) source sentence (1D, ending with eos)
+        :return: (Dict) the generated `tokens` (ending with eos), their mean
+            log-probability `score`, and the number of decoder passes of the model
+            (`steps`) and the draft model (`draft_steps`)
+        """
+        src_tokens = src_tokens.to(self.device).unsqueeze(0)
+        src_lengths = torch.tensor([src_tokens.size(1)], device=self.device)
+        encoder_out = self.model.encoder(src_tokens, src_lengths=src_lengths)
+        draft_encoder_out = self.draft_model.encoder(
+            src_tokens, src_lengths=src_lengths
+        )
+        max_len = min(
+            int(self.max_len_a * src_tokens.size(1) + self.max_len_b),
+            self.model.max_decoder_positions() - 1,
+            self.draft_model.max_decoder_positions() - 1,
+        )
+
+        # Both caches hold all tokens but the last one, which is fed next. The draft
+        # cache may lag behind.
+        tokens = src_tokens.new([[self.eos]])
+        state: incremental.IncrementalState = {}
+        draft_state: incremental.IncrementalState = {}
+        draft_cached = 0
+        score, steps, draft_steps = 0.0, 0, 0
+        while True:
+            num_generated = tokens.size(1) - 1
+
+            # The draft model proposes tokens greedily
+            draft_tokens = tokens
+            for _ in range(min(self.num_draft_tokens, max_len - num_generated)):
+                features = incremental.extend(
+                    self.draft_model.decoder,
+                    draft_tokens,
+                    draft_tokens.size(1) - draft_cached,
+                    draft_state,
+                    draft_encoder_out,
+                )
+                draft_cached = draft_tokens.size(1)
+                draft_steps += 1
+                lprobs = self._mask(
+                    self._lprobs(self.draft_model, features[:, -1:]),
+                    draft_tokens.size(1) - 1,
+                    max_len,
+                )
+                draft_tokens = torch.cat([draft_tokens, lprobs.argmax(-1, True)], 1)
+                if draft_tokens[0, -1] == self.eos:
+                    break
+            proposed = draft_tokens[0, tokens.size(1) :]
+
+            # The model predicts the token after the last one and after each proposed
+            # token in one pass
+            features = incremental.extend(
+                self.model.decoder,
+                draft_tokens,
+                len(proposed) + 1,
+                state,
+                encoder_out,
+            )
+            steps += 1
+            lprobs = self._mask(
+                self._lprobs(self.model, features), num_generated, max_len
+            )
+            predicted = lprobs.argmax(-1)
+
+            # Its predictions hold up to the first proposed token it disagrees with
+            new_tokens = []
+            for i, token in enumerate(predicted.tolist()):
+                new_tokens.append(token)
+                score += lprobs[i, token].item()
+                if token == self.eos or i == len(proposed) or proposed[i] != token:
+                    break
+            tokens = torch.cat([tokens, tokens.new([new_tokens])], 1)
+            incremental.truncate(self.model.decoder, state, tokens.size(1) - 1)
+            draft_cached = min(draft_cached, tokens.size(1) - 1)
+            incremental.truncate(self.draft_model.decoder, draft_state, draft_cached)
+
+            if new_tokens[-1] == self.eos:
+                break
+
+        generated = tokens[0, 1:]
+        return {
+            "tokens": generated,
+            "score": score / len(generated),
+            "steps": steps,
+            "draft_steps": draft_steps,
+        }
@@ -0,0 +1,299 @@
+# Copyright (c) 2020-2021 Joppe Geluykens
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+Lightweight instrumentation: spans (timed, nested regions), counters and histograms.
+
+Tracing is disabled by default, in which case `span` returns a shared no-op context
+manager and `count`/`observe` return right away. Enable it with `enable()`, and
+write the recorded data with `write()` (or on exit, with `enable(path)`): a JSON
+summary (per span name: count, total
+and a duration histogram; counters; histograms), and a Chrome trace of the spans
+(open in chrome://tracing or https://ui.perfetto.dev).
+
+Only the process that called `enable()` is traced, e.g. not the workers of a
+multiprocessing pool: time spent in pool workers shows up in the spans around the
+pool calls.
+"""
+import atexit
+import contextlib
+import functools
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+__all__ = [
+    "Histogram",
+    "Tracer",
+    "enable",
+    "disable",
+    "enabled",
+    "span",
+    "traced",
+    "trace_iter",
+    "count",
+    "observe",
+    "write",
+]
+
+logger = logging.getLogger("tracing")
+logger.addHandler(logging.StreamHandler(sys.stdout))
+logger.propagate = False
+logger.setLevel(logging.INFO)
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Histogram:
+    """Summary of observed values: count, sum, min, max and power-of-2 buckets."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        # Bucket b holds values in [2 ** (b - 1), 2 ** b), bucket 0 values below 1
+        self.buckets: Dict[int, int] = defaultdict(int)
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.buckets[math.frexp(value)[1] if value >= 1 else 0] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "buckets": {
+                f"<{2 ** b}": n for b, n in sorted(self.buckets.items())
+            },
+        }
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add_span(self.name, self.start, time.perf_counter_ns(), self.args)
+
+
+class Tracer:
+    """
+    Records spans, counters and histograms.
+
+    :param max_events: (int) max number of spans kept for the Chrome trace. Spans
+        beyond it only count towards the summary.
+    """
+
+    def __init__(self, max_events: int = 200_000):
+        self.max_events = max_events
+        self.start = time.perf_counter_ns()
+        self.events: List[Tuple[str, int, int, int, dict]] = []
+        self.dropped_events = 0
+        self.span_durations: Dict[str, Histogram] = defaultdict(Histogram)
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.histograms: Dict[str, Histogram] = defaultdict(Histogram)
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: int, end: int, args: dict):
+        with self._lock:
+            # Durations in microseconds
+            self.span_durations[name].add((end - start) / 1000)
+            if len(self.events) < self.max_events:
+                self.events.append(
+                    (name, start, end - start, threading.get_ident(), args)
+                )
+            else:
+                self.dropped_events += 1
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self.histograms[name].add(value)
+
+    def summary(self) -> dict:
+        return {
+            "wall_seconds": (time.perf_counter_ns() - self.start) / 1e9,
+            "spans": {
+                name: dict(
+                    hist.to_dict(),
+                    total_seconds=hist.sum / 1e6,
+                    unit="us",
+                )
+                for name, hist in sorted(
+                    self.span_durations.items(), key=lambda item: -item[1].sum
+                )
+            },
+            "counters": dict(self.counters),
+            "histograms": {
+                name: hist.to_dict() for name, hist in self.histograms.items()
+            },
+            "dropped_events": self.dropped_events,
+        }
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.start) / 1000,
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            }
+            for name, start, duration, tid, args in self.events
+        ]
+        end = (time.perf_counter_ns() - self.start) / 1000
+        events += [
+            {"name": name, "ph": "C", "ts": end, "pid": pid, "args": {name: value}}
+            for name, value in self.counters.items()
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable(path: Union[str, Path] = None, max_events: int = 200_000) -> Tracer:
+    """
+    Starts tracing (in this process).
+
+    :param path: (str) if provided, `write` the trace to this path on exit
+    """
+    global _tracer
+    _tracer = Tracer(max_events=max_events)
+    if path:
+        atexit.register(_write_on_exit, _tracer, path)
+    return _tracer
+
+
+def _write_on_exit(tracer: Tracer, path: Union[str, Path]):
+    # Unless tracing was disabled or restarted since
+    if tracer is _tracer:
+        paths = write(path)
+        logger.info(f"Wrote trace summary to {paths[0]}, Chrome trace to {paths[1]}")
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, **args):
+    """Context manager timing the code it wraps as span `name`, with `args`."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return _Span(_tracer, name, args)
+
+
+def traced(name: str = None):
+    """Decorator timing every call of the function as a span."""
+
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with _Span(_tracer, span_name, {}):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_iter(name: str, iterable: Iterable) -> Iterable:
+    """
+    Times each step of iterating `iterable` as a span, e.g. to measure the time spent
+    loading data in a lazy dataset iterator. Returns `iterable` as is if not tracing.
+    """
+    if _tracer is None:
+        return iterable
+    return _trace_iter(_tracer, name, iter(iterable))
+
+
+def _trace_iter(tracer: Tracer, name: str, iterator: Iterator) -> Iterator:
+    while True:
+        with _Span(tracer, name, {}):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(name: str, value: float = 1):
+    """Adds `value` to counter `name`."""
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+
+def observe(name: str, value: float):
+    """Adds `value` to histogram `name`."""
+    if _tracer is not None:
+        _tracer.observe(name, value)
+
+
+def write(path: Union[str, Path]) -> Optional[Tuple[Path, Path]]:
+    """
+    Writes the JSON summary to `path`, and the Chrome trace next to it, with suffix
+    .chrome.json.
+
+    :return: (Path, Path) the summary and Chrome trace paths, None if not tracing
+    """
+    if _tracer is None:
+        return None
+    path = Path(path)
+    trace_path = path.with_suffix(".chrome.json")
+    with open(path, "w") as f:
+        json.dump(_tracer.summary(), f, indent=2)
+    with open(trace_path, "w") as f:
+        json.dump(_tracer.chrome_trace(), f)
+    return path, trace_path
@@ -18,7 +18,11 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 from pathlib import Path
 
-__all__ = ["get_ckpt_dir", "replace_in_path"]
+__all__ = ["DECODING_MODES", "get_ckpt_dir", "get_results_dir", "replace_in_path"]
+
+# Decoding modes of pg-generate-predictions. Predictions of other modes than beam
+# search are stored in their own results dir (see get_results_dir).
+DECODING_MODES = ("beam", "constrained", "prefix_cached", "speculative")
 
 
 def get_ckpt_dir(orig_path, model_arch, version=None):
@@ -30,6 +34,20 @@ def get_ckpt_dir(orig_path, model_arch, version=None):
     return ckpt_dir
 
 
+def get_results_dir(
+    orig_path, model_arch, version=None, checkpoint=None, decoding="beam"
+):
+    results_dir = replace_in_path(orig_path, replace_part="data", new_part="results")
+    suffix = f"-{str(version)}" if version else ""
+    if checkpoint and checkpoint != "checkpoint_best.pt":
+        suffix += f"-{Path(checkpoint).stem}"
+    if decoding and decoding != "beam":
+        suffix += f"-{decoding}"
+    results_dir = results_dir / f"{model_arch}{suffix}"
+
+    return results_dir
+
+
 def replace_in_path(orig_path: Path, replace_part: str, new_part: str):
     part_index = orig_path.parts.index(replace_part)
 
@@ -28,7 +28,13 @@ setup(
         "bin/pg-bpe-download",
         "bin/pg-prepare-data",
         "bin/pg-train-model",
+        "bin/pg-find-batch-size",
+        "bin/pg-sweep",
+        "bin/pg-distill",
+        "bin/pg-export-model",
+        "bin/pg-prune-vocab",
         "bin/pg-generate-predictions",
+        "bin/pg-postprocess-predictions",
         "bin/pg-evaluate-model",
     ],
     extras_require={"mlflow": ["mlflow==1.13.1"]},